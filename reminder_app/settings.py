@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -106,6 +107,23 @@ SIMPLE_JWT = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    # Archived notification history (see reminders.archive); kept out of
+    # MEDIA_ROOT so it isn't served. Swap the backend for object storage.
+    'notification_archive': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': env('NOTIFICATION_ARCHIVE_ROOT', '') or os.path.join(BASE_DIR, 'archive'),
+        },
+    },
+}
+
 ROOT_URLCONF = 'reminder_app.urls'
 
 TEMPLATES = [
@@ -191,6 +209,24 @@ EMAIL_USE_TLS = env('EMAIL_USE_TLS', 'True') == 'True'
 EMAIL_HOST_USER = env('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD', '')
 
+# Redis used by the notification timing wheel and rate limiter
+REDIS_URL = env('REDIS_URL', 'redis://localhost:6379/0')
+
+# Bounded per-process cache, e.g. for users' timezones (see reminders.timezones).
+# Swap it for django.core.cache.backends.redis.RedisCache at REDIS_URL to share
+# it between processes, so a profile change is seen everywhere right away.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(env('CACHE_MAX_ENTRIES', '10000')),
+        },
+    },
+}
+
+# Seconds a user's timezone stays cached (profile saves clear it right away)
+TIMEZONE_CACHE_TTL = int(env('TIMEZONE_CACHE_TTL', '300'))
+
 # Celery settings
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
@@ -199,6 +235,99 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/Istanbul'
 
+# Notification dispatch settings
+# Number of dispatcher workers fanned out by send_due_notifications; each one
+# claims disjoint batches with SELECT ... FOR UPDATE SKIP LOCKED
+NOTIFICATION_DISPATCH_WORKERS = int(env('NOTIFICATION_DISPATCH_WORKERS', '1'))
+NOTIFICATION_DISPATCH_BATCH_SIZE = int(env('NOTIFICATION_DISPATCH_BATCH_SIZE', '100'))
+# Seconds after which an unfinished claim is considered abandoned and can be re-claimed
+NOTIFICATION_CLAIM_TIMEOUT = int(env('NOTIFICATION_CLAIM_TIMEOUT', '300'))
+# Dispatchers reserved for urgent (high priority or flagged) notifications,
+# sent to their own Celery queue; run a worker with -Q notifications-urgent
+NOTIFICATION_URGENT_DISPATCH_WORKERS = int(env('NOTIFICATION_URGENT_DISPATCH_WORKERS', '0'))
+NOTIFICATION_URGENT_QUEUE = env('NOTIFICATION_URGENT_QUEUE', 'notifications-urgent')
+# 'sync' delivers channels one after another, 'async' uses reminders.delivery_engine
+NOTIFICATION_DELIVERY_BACKEND = env('NOTIFICATION_DELIVERY_BACKEND', 'sync')
+# Maximum in-flight sends per channel for the async delivery engine
+NOTIFICATION_CHANNEL_CONCURRENCY = {
+    'fcm': int(env('NOTIFICATION_FCM_CONCURRENCY', '4')),
+    'smtp': int(env('NOTIFICATION_SMTP_CONCURRENCY', '4')),
+}
+# Emails sent on one SMTP connection before it is recycled
+NOTIFICATION_EMAIL_BATCH_SIZE = int(env('NOTIFICATION_EMAIL_BATCH_SIZE', '50'))
+# Standalone engine (manage.py run_delivery_engine): concurrent batches, lanes reserved
+# for urgent notifications and idle poll interval
+NOTIFICATION_ENGINE_LANES = int(env('NOTIFICATION_ENGINE_LANES', '2'))
+NOTIFICATION_ENGINE_URGENT_LANES = int(env('NOTIFICATION_ENGINE_URGENT_LANES', '1'))
+NOTIFICATION_ENGINE_POLL_INTERVAL = float(env('NOTIFICATION_ENGINE_POLL_INTERVAL', '5'))
+
+# Failed deliveries are retried with jittered exponential backoff (seconds)
+# and dead-lettered after the maximum number of attempts
+NOTIFICATION_RETRY_MAX_ATTEMPTS = int(env('NOTIFICATION_RETRY_MAX_ATTEMPTS', '5'))
+NOTIFICATION_RETRY_BASE_DELAY = int(env('NOTIFICATION_RETRY_BASE_DELAY', '60'))
+NOTIFICATION_RETRY_MAX_DELAY = int(env('NOTIFICATION_RETRY_MAX_DELAY', '3600'))
+
+# Token-bucket rate limits per outbound channel, shared by all workers through Redis.
+# 'rate' is messages per second and 'burst' the bucket size; work over the limit is deferred
+NOTIFICATION_RATE_LIMIT_ENABLED = env('NOTIFICATION_RATE_LIMIT_ENABLED', 'False') == 'True'
+NOTIFICATION_RATE_LIMITS = {
+    'fcm': {
+        'rate': float(env('NOTIFICATION_FCM_RATE', '500')),
+        'burst': int(env('NOTIFICATION_FCM_BURST', '1000')),
+    },
+    'smtp': {
+        'rate': float(env('NOTIFICATION_SMTP_RATE', '10')),
+        'burst': int(env('NOTIFICATION_SMTP_BURST', '20')),
+    },
+}
+
+# Redis sorted-set timing wheel used by the delivery engine to fire notifications
+# on the second; the database dispatch task keeps running as a safety net
+NOTIFICATION_TIMING_WHEEL_ENABLED = env('NOTIFICATION_TIMING_WHEEL_ENABLED', 'False') == 'True'
+NOTIFICATION_TIMING_WHEEL_TICK = float(env('NOTIFICATION_TIMING_WHEEL_TICK', '1'))
+# How far ahead the reconciliation sweep loads unsent notifications into the wheel (seconds)
+NOTIFICATION_TIMING_WHEEL_HORIZON = int(env('NOTIFICATION_TIMING_WHEEL_HORIZON', '86400'))
+
+# Coalesce a user's notifications that fall due within NOTIFICATION_DIGEST_WINDOW
+# seconds into one digest push and email, once there are at least
+# NOTIFICATION_DIGEST_THRESHOLD of them
+NOTIFICATION_DIGEST_ENABLED = env('NOTIFICATION_DIGEST_ENABLED', 'False') == 'True'
+NOTIFICATION_DIGEST_WINDOW = int(env('NOTIFICATION_DIGEST_WINDOW', '60'))
+NOTIFICATION_DIGEST_THRESHOLD = int(env('NOTIFICATION_DIGEST_THRESHOLD', '3'))
+
+# Recurring reminders keep notifications for a rolling window of upcoming
+# occurrences (at most NOTIFICATION_RECURRENCE_MAX_OCCURRENCES); the nightly
+# job extends reminders whose window ends within NOTIFICATION_RECURRENCE_REFILL_DAYS
+NOTIFICATION_RECURRENCE_WINDOW_DAYS = int(env('NOTIFICATION_RECURRENCE_WINDOW_DAYS', '7'))
+NOTIFICATION_RECURRENCE_MAX_OCCURRENCES = int(env('NOTIFICATION_RECURRENCE_MAX_OCCURRENCES', '100'))
+NOTIFICATION_RECURRENCE_REFILL_DAYS = int(env('NOTIFICATION_RECURRENCE_REFILL_DAYS', '2'))
+# Reminders per refill_recurring_chunk task fanned out by reschedule_recurring_reminders
+NOTIFICATION_RECURRENCE_CHUNK_SIZE = int(env('NOTIFICATION_RECURRENCE_CHUNK_SIZE', '500'))
+
+# Overdue notifications inserted per bulk_create by check_overdue_items
+NOTIFICATION_OVERDUE_CHUNK_SIZE = int(env('NOTIFICATION_OVERDUE_CHUNK_SIZE', '1000'))
+
+# PostgreSQL range partitioning of notifications by scheduled_time ('month' or
+# 'week'), set up with manage.py notification_partitions convert. Once enabled,
+# clean_old_notifications creates NOTIFICATION_PARTITIONS_AHEAD partitions ahead
+# and drops (or, with NOTIFICATION_PARTITION_DETACH, detaches) expired ones
+NOTIFICATION_PARTITIONING_ENABLED = env('NOTIFICATION_PARTITIONING_ENABLED', 'False') == 'True'
+NOTIFICATION_PARTITION_INTERVAL = env('NOTIFICATION_PARTITION_INTERVAL', 'month')
+NOTIFICATION_PARTITIONS_AHEAD = int(env('NOTIFICATION_PARTITIONS_AHEAD', '3'))
+NOTIFICATION_PARTITION_DETACH = env('NOTIFICATION_PARTITION_DETACH', 'False') == 'True'
+
+# Archive sent notifications to gzipped NDJSON files in the notification_archive
+# storage before clean_old_notifications removes them, NOTIFICATION_ARCHIVE_CHUNK_SIZE
+# rows per file
+NOTIFICATION_ARCHIVE_ENABLED = env('NOTIFICATION_ARCHIVE_ENABLED', 'False') == 'True'
+NOTIFICATION_ARCHIVE_CHUNK_SIZE = int(env('NOTIFICATION_ARCHIVE_CHUNK_SIZE', '5000'))
+
+# Reschedule notifications of saved reminders and subtasks in a Celery task
+# after the request commits instead of inside the request; saves made before
+# the task runs collapse into one job (the marker expires after the TTL in seconds)
+NOTIFICATION_ASYNC_SCHEDULING = env('NOTIFICATION_ASYNC_SCHEDULING', 'False') == 'True'
+NOTIFICATION_RESCHEDULE_DEDUPE_TTL = int(env('NOTIFICATION_RESCHEDULE_DEDUPE_TTL', '300'))
+
 # Celery Beat schedule settings
 CELERY_BEAT_SCHEDULE = {
     'send-due-notifications': {
@@ -213,9 +342,14 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'reminders.tasks.clean_old_notifications',
         'schedule': 3600.0 * 24 * 7,  
     },
+    # Every hour, for the users whose local day just started
     'check-overdue-items': {
-        'task': 'reminders.tasks.check_overdue_items',
-        'schedule': 3600.0 * 24,  
+        'task': 'reminders.tasks.check_overdue_items_by_timezone',
+        'schedule': crontab(minute=0),
+    },
+    'reconcile-timing-wheel': {
+        'task': 'reminders.tasks.reconcile_timing_wheel',
+        'schedule': 600.0,
     },
 }
 
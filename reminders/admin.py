@@ -4,7 +4,7 @@ from django.urls import reverse
 from django.db.models import Count
 from .models import (
     Reminder, SubTask, Tag,
-    DeviceToken, Notification, SharedReminder, UserProfile
+    DeviceToken, Notification, SharedReminder, UserProfile, DeliveryAttempt
 )
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
@@ -323,12 +323,21 @@ class DeviceTokenAdmin(admin.ModelAdmin):
     deactivate_tokens.short_description = "Deactivate selected device tokens"
 
 
+class DeliveryAttemptInline(admin.TabularInline):
+    model = DeliveryAttempt
+    extra = 0
+    can_delete = False
+    fields = ('channel', 'device', 'status', 'attempts', 'last_error', 'updated_at')
+    readonly_fields = fields
+
+
 @admin.register(Notification)
 class NotificationAdmin(admin.ModelAdmin):
-    list_display = ('title', 'user', 'reminder_link', 'scheduled_time', 'sent', 'sent_at')
-    list_filter = ('sent', 'scheduled_time', 'user')
+    list_display = ('title', 'user', 'reminder_link', 'scheduled_time', 'priority', 'status', 'attempts', 'sent_at')
+    list_filter = ('status', 'priority', 'sent', 'scheduled_time', 'user')
     search_fields = ('title', 'message', 'user__username', 'reminder__title')
-    readonly_fields = ('sent', 'sent_at')
+    readonly_fields = ('sent', 'sent_at', 'status', 'attempts', 'next_attempt_at', 'last_error')
+    inlines = [DeliveryAttemptInline]
     
     def reminder_link(self, obj):
         url = reverse('admin:reminders_reminder_change', args=[obj.reminder.id])
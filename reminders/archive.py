@@ -0,0 +1,221 @@
+import gzip
+import hashlib
+import json
+import tempfile
+import uuid
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import transaction
+from django.utils import timezone
+from .models import DeliveryAttempt, DeviceToken, Notification
+
+# Version 2 added the delivery attempts of each chunk
+FORMAT_VERSION = 2
+
+
+def is_enabled():
+    return getattr(settings, 'NOTIFICATION_ARCHIVE_ENABLED', False)
+
+
+def get_storage():
+    """The storage archives are written to (STORAGES['notification_archive'] by default)"""
+    return storages[getattr(settings, 'NOTIFICATION_ARCHIVE_STORAGE', 'notification_archive')]
+
+
+def get_fields(model=Notification):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def archive_notifications(cutoff, chunk_size=None, storage=None, notifications=None, delete=True):
+    """
+    Move sent notifications older than cutoff to gzipped NDJSON files.
+
+    Rows are read in primary-key order, NOTIFICATION_ARCHIVE_CHUNK_SIZE at a
+    time, so memory use doesn't depend on how much is archived. Each chunk
+    and the delivery attempts of its notifications are written to their own
+    files and stored before the rows are deleted (with their attempts), in
+    the same transaction that selected them. A manifest.json next to the
+    files lists every chunk with its id range, row counts and SHA-256s, and
+    is rewritten after each chunk so an interrupted run can still be
+    restored.
+
+    notifications replaces the rows to archive; with delete=False they are
+    only copied, e.g. when their partitions are dropped afterwards. Returns
+    the manifest's storage name, or None if nothing was archived.
+    """
+    chunk_size = chunk_size or getattr(settings, 'NOTIFICATION_ARCHIVE_CHUNK_SIZE', 5000)
+    storage = storage or get_storage()
+    fields = get_fields()
+    attempt_fields = get_fields(DeliveryAttempt)
+    if notifications is None:
+        notifications = Notification.objects.filter(sent=True, sent_at__lt=cutoff)
+    expired = notifications.order_by('pk')
+    if delete:
+        expired = expired.select_for_update(skip_locked=True)
+
+    run = timezone.now()
+    # The random suffix keeps runs started within the same second apart
+    directory = f"notifications/{run:%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+    manifest = {
+        'version': FORMAT_VERSION,
+        'model': Notification._meta.label,
+        'created_at': run.isoformat(),
+        'cutoff': cutoff.isoformat(),
+        'fields': fields,
+        'attempt_fields': attempt_fields,
+        'rows': 0,
+        'attempts': 0,
+        'chunks': [],
+    }
+    manifest_name = f"{directory}/manifest.json"
+    last_id = 0
+
+    while True:
+        with transaction.atomic():
+            rows = list(expired.filter(pk__gt=last_id).values_list(*fields)[:chunk_size])
+            if not rows:
+                break
+
+            ids = [row[0] for row in rows]
+            number = len(manifest['chunks']) + 1
+            name, digest = write_chunk(storage, f"{directory}/chunk-{number:06d}.ndjson.gz", fields, rows)
+
+            attempts = list(
+                DeliveryAttempt.objects.filter(notification_id__in=ids).order_by('pk').values_list(*attempt_fields)
+            )
+            attempts_name, attempts_digest = write_chunk(
+                storage, f"{directory}/attempts-{number:06d}.ndjson.gz", attempt_fields, attempts
+            )
+
+            if delete:
+                Notification.objects.filter(pk__in=ids).delete()
+
+        last_id = ids[-1]
+        manifest['rows'] += len(rows)
+        manifest['attempts'] += len(attempts)
+        manifest['chunks'].append({
+            'file': name,
+            'rows': len(rows),
+            'first_id': ids[0],
+            'last_id': last_id,
+            'sha256': digest,
+            'attempts': {'file': attempts_name, 'rows': len(attempts), 'sha256': attempts_digest},
+        })
+        write_manifest(storage, manifest_name, manifest)
+
+    return manifest_name if manifest['chunks'] else None
+
+
+def encode_value(value):
+    # Full ISO timestamps (DjangoJSONEncoder would drop the microseconds)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def write_chunk(storage, name, fields, rows):
+    """Write rows as gzipped NDJSON through a temporary file; returns the stored name and SHA-256"""
+    with tempfile.TemporaryFile() as tmp:
+        with gzip.GzipFile(fileobj=tmp, mode='wb') as compressed:
+            for row in rows:
+                compressed.write(json.dumps(dict(zip(fields, row)), default=encode_value).encode() + b'\n')
+
+        tmp.seek(0)
+        digest = hashlib.sha256()
+        for block in iter(lambda: tmp.read(1 << 16), b''):
+            digest.update(block)
+
+        tmp.seek(0)
+        return storage.save(name, File(tmp)), digest.hexdigest()
+
+
+def write_manifest(storage, name, manifest):
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(json.dumps(manifest, indent=2).encode()))
+
+
+def restore_archive(manifest_name, storage=None, batch_size=1000):
+    """
+    Load an archive's notifications and delivery attempts back into the tables.
+
+    Chunks are checked against the manifest's SHA-256 and streamed back in
+    batches; rows whose id already exists are skipped, and attempts whose
+    device was deleted since lose their device. Returns the number of
+    notifications read.
+    """
+    storage = storage or get_storage()
+    with storage.open(manifest_name) as f:
+        manifest = json.load(f)
+    if manifest.get('version') not in (1, FORMAT_VERSION) or manifest.get('model') != Notification._meta.label:
+        raise ValueError(f"Unsupported notification archive: {manifest_name}")
+
+    restored = 0
+    for chunk in manifest['chunks']:
+        restored += restore_chunk(storage, chunk, Notification, batch_size)
+        if chunk.get('attempts'):
+            restore_chunk(storage, chunk['attempts'], DeliveryAttempt, batch_size)
+
+    return restored
+
+
+def restore_chunk(storage, chunk, model, batch_size):
+    """Verify one chunk file and bulk-create its rows; returns the number of rows read"""
+    digest = hashlib.sha256()
+    with storage.open(chunk['file']) as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    if digest.hexdigest() != chunk['sha256']:
+        raise ValueError(f"Checksum mismatch for archive chunk {chunk['file']}")
+
+    fields = {field.attname: field for field in model._meta.concrete_fields}
+    # bulk_create stamps auto_now fields with the current time, so the
+    # archived values are written back afterwards
+    timestamps = [
+        name for name, field in fields.items()
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    restored = 0
+    batch = []
+
+    def flush():
+        if model is DeliveryAttempt:
+            devices = set(DeviceToken.objects.filter(
+                pk__in={row.device_id for row in batch if row.device_id}
+            ).values_list('pk', flat=True))
+            for row in batch:
+                if row.device_id not in devices:
+                    row.device_id = None
+
+        archived = [[getattr(row, name) for name in timestamps] for row in batch]
+        # Rows that are already in the table are skipped by bulk_create, so
+        # their timestamps must not be overwritten either
+        existing = set(model.objects.filter(pk__in=[row.pk for row in batch]).values_list('pk', flat=True))
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+        if timestamps:
+            inserted = []
+            for row, values in zip(batch, archived):
+                if row.pk in existing:
+                    continue
+                for name, value in zip(timestamps, values):
+                    setattr(row, name, value)
+                inserted.append(row)
+            model.objects.bulk_update(inserted, timestamps)
+
+    with storage.open(chunk['file']) as f, gzip.GzipFile(fileobj=f) as lines:
+        for line in lines:
+            data = json.loads(line)
+            batch.append(model(**{
+                name: fields[name].to_python(value) for name, value in data.items() if name in fields
+            }))
+            if len(batch) == batch_size:
+                flush()
+                restored += len(batch)
+                batch = []
+    if batch:
+        flush()
+        restored += len(batch)
+
+    return restored
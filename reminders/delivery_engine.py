@@ -0,0 +1,221 @@
+import asyncio
+import math
+import time
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from .email_sender import EmailBatchSender
+from . import digest, outbox, timing_wheel
+from .models import Notification
+from .notification_service import NotificationService
+
+# Default number of in-flight sends per channel. New channels (e.g. APNs)
+# only need an entry here and a send coroutine in DeliveryEngine.
+DEFAULT_CHANNEL_CONCURRENCY = {
+    'fcm': 4,
+    'smtp': 4,
+}
+
+# Seconds a long-running engine keeps cached device tokens before reloading them
+TOKEN_CACHE_TTL = 60
+
+
+class DeliveryEngine:
+    """
+    asyncio delivery engine that overlaps I/O-bound sends across channels.
+
+    Every channel has its own semaphore bounding how many sends are in flight
+    at once. The Firebase Admin SDK and Django's mail backends are blocking,
+    so each send runs in a worker thread while the event loop schedules them;
+    database access goes through sync_to_async. SMTP sends draw from a small
+    pool of pooled connections (one per allowed in-flight send).
+    """
+
+    def __init__(self, concurrency=None):
+        self.limits = dict(DEFAULT_CHANNEL_CONCURRENCY)
+        self.limits.update(concurrency or getattr(settings, 'NOTIFICATION_CHANNEL_CONCURRENCY', {}))
+        self.semaphores = {
+            channel: asyncio.Semaphore(limit) for channel, limit in self.limits.items()
+        }
+        self.email_senders = []
+        # Active device tokens per user id, shared by every batch the engine delivers
+        self.token_cache = {}
+        self.token_cache_loaded_at = time.monotonic()
+
+    @classmethod
+    def dispatch(cls, worker_id, batch_size=None, max_batches=None, priorities=None):
+        """Claim and deliver due batches from synchronous code (e.g. a Celery task)"""
+        return async_to_sync(cls().drain)(worker_id, batch_size, max_batches, priorities)
+
+    async def drain(self, worker_id, batch_size=None, max_batches=None, priorities=None):
+        """Claim and deliver batches until nothing is due, returning the same stats as the sync dispatcher"""
+        stats = {'batches': 0, 'deferred': 0, 'pruned_tokens': 0}
+        try:
+            while max_batches is None or stats['batches'] < max_batches:
+                batch = await sync_to_async(NotificationService.claim_due_notifications)(
+                    worker_id, batch_size, priorities=priorities
+                )
+                if not batch:
+                    break
+
+                outcome = await self.deliver_batch(batch)
+                stats['batches'] += 1
+                stats['deferred'] += outcome['deferred']
+                stats['pruned_tokens'] += outcome['pruned_tokens']
+
+                # Providers are at their rate limit; leave the rest for the next run
+                if outcome['deferred'] == len(batch):
+                    break
+        finally:
+            await self.close()
+
+        if stats['pruned_tokens']:
+            print(f"Deactivated {stats['pruned_tokens']} invalid device tokens")
+
+        return stats
+
+    async def run(self, channel, func, *args):
+        """Run a blocking send in a thread, bounded by the channel's concurrency"""
+        async with self.semaphores[channel]:
+            return await asyncio.to_thread(func, *args)
+
+    async def send_emails(self, notifications, errors):
+        """Send a group of emails on a pooled SMTP connection"""
+        async with self.semaphores['smtp']:
+            sender = self.email_senders.pop() if self.email_senders else EmailBatchSender()
+            try:
+                return await asyncio.to_thread(NotificationService.send_email_batch, notifications, sender, errors)
+            finally:
+                self.email_senders.append(sender)
+
+    async def deliver_batch(self, batch):
+        """
+        Send push and email for a claimed batch concurrently, then record the outcome.
+
+        Returns how many notifications the rate limiter deferred and how many
+        device tokens were deactivated because FCM reported them invalid.
+        """
+        errors = {}
+        invalid_device_ids = set()
+        targets = await sync_to_async(NotificationService.prepare_push_targets)(batch, self.token_cache)
+        batch, targets, deferred = await sync_to_async(NotificationService.apply_rate_limits)(batch, targets)
+        targets, email_batch, delivered = await sync_to_async(outbox.reserve)(
+            targets,
+            [notification for notification in batch if NotificationService.wants_email(notification)]
+        )
+
+        push_jobs = [
+            self.run('fcm', NotificationService.send_messages, chunk)
+            for chunk in NotificationService.chunk_targets(targets)
+        ]
+
+        # Spread the batch's emails over every SMTP connection the engine may
+        # use, keeping whole digest runs on the same connection so each one is
+        # grouped exactly as the rate limiter counted it
+        digest_runs = digest.runs(email_batch)
+        run_size = max(1, math.ceil(len(digest_runs) / self.limits['smtp']))
+        email_jobs = [
+            self.send_emails([n for run in digest_runs[start:start + run_size] for n in run], errors)
+            for start in range(0, len(digest_runs), run_size)
+        ]
+
+        push_chunks, email_groups = await asyncio.gather(
+            asyncio.gather(*push_jobs),
+            asyncio.gather(*email_jobs),
+        )
+
+        results = [result for chunk in push_chunks for result in chunk]
+        push_results = await sync_to_async(NotificationService.record_push_results)(
+            results, errors, invalid_device_ids
+        )
+
+        email_results = {}
+        for group in email_groups:
+            email_results.update(group)
+
+        await sync_to_async(outbox.acknowledge)(results, email_results, errors)
+        push_results.update(dict.fromkeys(delivered['push'], True))
+        email_results.update(dict.fromkeys(delivered['email'], True))
+
+        await sync_to_async(NotificationService.finish_batch)(batch, push_results, email_results, errors)
+        pruned_tokens = await sync_to_async(NotificationService.prune_device_tokens)(invalid_device_ids, self.token_cache)
+
+        return {'deferred': deferred, 'pruned_tokens': pruned_tokens}
+
+    async def close(self):
+        """Close pooled SMTP connections"""
+        senders, self.email_senders = self.email_senders, []
+        for sender in senders:
+            await asyncio.to_thread(sender.close)
+
+    async def serve(self, worker_id=None, lanes=None, poll_interval=None, urgent_lanes=None):
+        """
+        Run as a long-lived process.
+
+        Several lanes claim and deliver batches concurrently; claims keep the
+        lanes (and any other dispatcher workers) on disjoint notifications.
+        Urgent lanes only claim urgent notifications, so high priority and
+        flagged reminders keep dedicated capacity when the others are saturated.
+        """
+        worker_id = worker_id or NotificationService.get_worker_id()
+        lanes = lanes or getattr(settings, 'NOTIFICATION_ENGINE_LANES', 2)
+        if urgent_lanes is None:
+            urgent_lanes = getattr(settings, 'NOTIFICATION_ENGINE_URGENT_LANES', 1)
+        if timing_wheel.is_enabled():
+            # Popping the wheel is cheap, so tick every second for precise firing
+            poll_interval = poll_interval or getattr(settings, 'NOTIFICATION_TIMING_WHEEL_TICK', 1)
+        poll_interval = poll_interval or getattr(settings, 'NOTIFICATION_ENGINE_POLL_INTERVAL', 5)
+
+        try:
+            await asyncio.gather(
+                *(self.run_lane(f"{worker_id}:{lane}", poll_interval) for lane in range(lanes)),
+                *(
+                    self.run_lane(f"{worker_id}:urgent-{lane}", poll_interval, [Notification.PRIORITY_URGENT])
+                    for lane in range(urgent_lanes)
+                ),
+            )
+        finally:
+            await self.close()
+
+    def expire_token_cache(self):
+        """Drop cached device tokens so a long-running engine sees new and removed devices"""
+        if time.monotonic() - self.token_cache_loaded_at >= TOKEN_CACHE_TTL:
+            self.token_cache.clear()
+            self.token_cache_loaded_at = time.monotonic()
+
+    @staticmethod
+    def claim_next_batch(worker_id, priorities=None):
+        """Claim the next batch, using ids popped from the timing wheel when it is enabled"""
+        # Lanes restricted to some priorities claim straight from the database,
+        # since popping the wheel would take other lanes' notifications off it
+        if priorities is not None or not timing_wheel.is_enabled():
+            return NotificationService.claim_due_notifications(worker_id, priorities=priorities)
+
+        notification_ids = timing_wheel.TimingWheel().pop_due()
+        if not notification_ids:
+            return []
+        return NotificationService.claim_due_notifications(worker_id, notification_ids=notification_ids)
+
+    async def run_lane(self, worker_id, poll_interval, priorities=None):
+        while True:
+            self.expire_token_cache()
+            # Like Django does around each request: drop a broken or expired
+            # connection before every claim, so the lane reconnects after a
+            # database restart instead of failing for good. Database calls
+            # run in the sync_to_async thread, which owns the connection.
+            await sync_to_async(close_old_connections)()
+            try:
+                batch = await sync_to_async(self.claim_next_batch)(worker_id, priorities)
+                if not batch:
+                    await asyncio.sleep(poll_interval)
+                    continue
+
+                outcome = await self.deliver_batch(batch)
+                if outcome['pruned_tokens']:
+                    print(f"Delivery lane {worker_id} deactivated {outcome['pruned_tokens']} invalid device tokens")
+                if outcome['deferred'] == len(batch):
+                    # Providers are at their rate limit; back off before claiming again
+                    await asyncio.sleep(poll_interval)
+            except Exception as e:
+                print(f"Delivery lane {worker_id} failed: {e}")
+                await asyncio.sleep(poll_interval)
@@ -0,0 +1,68 @@
+from datetime import timedelta
+from django.conf import settings
+
+# Number of notification titles listed in a digest push before "and N more"
+PUSH_SUMMARY_TITLES = 3
+
+
+def is_enabled():
+    return getattr(settings, 'NOTIFICATION_DIGEST_ENABLED', False)
+
+
+def group(notifications):
+    """
+    Split notifications into delivery groups of one or more notifications.
+
+    A user's notifications that fall due within NOTIFICATION_DIGEST_WINDOW
+    seconds of the first one are coalesced into a digest. Groups smaller
+    than NOTIFICATION_DIGEST_THRESHOLD are split back up, so occasional
+    notifications are still delivered one by one. Groups are ordered by user.
+    """
+    if not is_enabled():
+        return [[notification] for notification in notifications]
+
+    threshold = max(2, getattr(settings, 'NOTIFICATION_DIGEST_THRESHOLD', 3))
+    return [group for run in runs(notifications) for group in split(run, threshold)]
+
+
+def runs(notifications):
+    """
+    Split notifications into the windows group() coalesces, before small ones are split up.
+
+    Each run starts at a user's first notification not covered by the
+    previous run, so leaving out whole runs doesn't change how the others
+    are grouped.
+    """
+    if not is_enabled():
+        return [[notification] for notification in notifications]
+
+    window = timedelta(seconds=getattr(settings, 'NOTIFICATION_DIGEST_WINDOW', 60))
+
+    result = []
+    current = []
+    for notification in sorted(notifications, key=lambda n: (n.user_id, n.next_attempt_at, n.id)):
+        if current and (
+            notification.user_id != current[0].user_id
+            or notification.next_attempt_at - current[0].next_attempt_at > window
+        ):
+            result.append(current)
+            current = []
+        current.append(notification)
+    if current:
+        result.append(current)
+    return result
+
+
+def split(notifications, threshold):
+    if len(notifications) >= threshold:
+        return [notifications]
+    return [[notification] for notification in notifications]
+
+
+def summarize(notifications):
+    """Return the (title, body) of a digest push for a group of notifications"""
+    titles = [notification.title for notification in notifications]
+    body = ", ".join(titles[:PUSH_SUMMARY_TITLES])
+    if len(titles) > PUSH_SUMMARY_TITLES:
+        body += f" and {len(titles) - PUSH_SUMMARY_TITLES} more"
+    return f"You have {len(titles)} reminders due", body
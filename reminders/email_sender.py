@@ -0,0 +1,65 @@
+import smtplib
+from django.conf import settings
+from django.core.mail import get_connection
+
+
+class EmailBatchSender:
+    """
+    Send notification emails over one reused SMTP connection.
+
+    The connection is opened lazily and shared by every message sent through
+    the sender, so a dispatch run pays for the TLS handshake and login once
+    instead of once per email. It is recycled after NOTIFICATION_EMAIL_BATCH_SIZE
+    messages (many servers cap messages per session) and re-established once
+    if the server drops it mid-batch.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or getattr(settings, 'NOTIFICATION_EMAIL_BATCH_SIZE', 50)
+        self.connection = None
+        self.sent_on_connection = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False)
+            self.connection.open()
+            self.sent_on_connection = 0
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception as e:
+                print(f"Failed to close SMTP connection: {e}")
+            self.connection = None
+
+    def send_messages(self, messages):
+        """Send EmailMessage objects and return a (sent, error) tuple per message"""
+        return [self.send_message(message) for message in messages]
+
+    def send_message(self, message):
+        error = None
+        for attempt in range(2):
+            try:
+                self.open()
+                sent = self.connection.send_messages([message])
+                self.sent_on_connection += 1
+                if self.sent_on_connection >= self.batch_size:
+                    self.close()
+                return bool(sent), None if sent else 'Message was not accepted'
+            except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError) as e:
+                # Connection went away: reconnect and retry this message once
+                self.close()
+                error = e
+            except Exception as e:
+                error = e
+                break
+
+        print(f"Failed to send email notification to {message.to}: {error}")
+        return False, str(error)
@@ -0,0 +1,96 @@
+import time
+from datetime import date, time as dt_time
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from reminders import email_templates
+
+
+def render_fstring(title, message, item, item_type):
+    """The original f-string renderer of notification emails, kept as the baseline"""
+    subject = f"Reminder: {title}"
+
+    date_str = item.date.strftime('%A, %B %d, %Y') if item.date else None
+    time_str = item.time.strftime('%I:%M %p') if hasattr(item, 'time') and item.time else None
+
+    html_message = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; }}
+                .container {{ padding: 20px; }}
+                .reminder {{ background-color: #f8f9fa; padding: 15px; border-radius: 5px; }}
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <h1>{title}</h1>
+
+                <div class="reminder">
+                    <p><strong>Type:</strong> {item_type.capitalize()}</p>
+                    <p>{message}</p>
+
+                    {f'<p><strong>Date:</strong> {date_str}</p>' if date_str else ''}
+                    {f'<p><strong>Time:</strong> {time_str}</p>' if time_str else ''}
+                </div>
+
+                <p style="margin-top: 20px;">
+                    This is a reminder from Reminder App.
+                </p>
+            </div>
+        </body>
+        </html>
+        """
+
+    plain_message = f"""
+        {title}
+
+        Type: {item_type.capitalize()}
+
+        {message}
+
+        When: {date_str or 'No date'} {time_str or ''}
+
+        Open the app to view more details.
+        """
+    return subject, plain_message, html_message
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-email render cost of notification emails against the original f-string renderer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=5000, help='Number of emails to render')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Emails rendered per batch call')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        chunk_size = options['chunk_size']
+        item = SimpleNamespace(date=date.today(), time=dt_time(9, 30))
+        entries = [(f"Reminder {i}", "Benchmark notification body", item, "reminder") for i in range(count)]
+
+        start = time.perf_counter()
+        for entry in entries:
+            render_fstring(*entry)
+        before = self.report('before: original f-strings', start, count)
+
+        # Building the contexts is timed too, since it formats the dates
+        start = time.perf_counter()
+        for entry in entries:
+            email_templates.render_email(email_templates.build_context(*entry))
+        self.report('render_email', start, count)
+
+        start = time.perf_counter()
+        for offset in range(0, count, chunk_size):
+            email_templates.render_email_batch([
+                email_templates.build_context(*entry) for entry in entries[offset:offset + chunk_size]
+            ])
+        after = self.report(f'after: render_email_batch (chunks of {chunk_size})', start, count)
+
+        # The current renderer also escapes titles and messages in the HTML body
+        self.stdout.write(f"Current vs original renderer: {after / before:.1f}x the render time per email")
+
+    def report(self, label, start, count):
+        per_email = (time.perf_counter() - start) / count * 1e6
+        self.stdout.write(f"{label}: {per_email:.1f} us/email")
+        return per_email
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from reminders import partitions
+
+
+class Command(BaseCommand):
+    help = 'Manage PostgreSQL range partitions of the notification table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'action', choices=['convert', 'create', 'drop-expired', 'list'],
+            help='convert the table to a partitioned one, create upcoming partitions, '
+                 'drop expired partitions or list the existing ones'
+        )
+        parser.add_argument('--ahead', type=int, help='Number of partitions to create ahead of the current one')
+        parser.add_argument('--days', type=int, default=30, help='Partitions ending more than this many days ago are expired')
+        parser.add_argument('--detach', action='store_true', help='Detach expired partitions instead of dropping them')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Notification partitioning requires PostgreSQL')
+
+        action = options['action']
+        if action == 'convert':
+            if partitions.is_partitioned():
+                raise CommandError('The notification table is already partitioned')
+            partitions.convert_table(options['ahead'])
+            self.stdout.write('Notification table converted to a partitioned table')
+        elif not partitions.is_partitioned():
+            raise CommandError('The notification table is not partitioned; run "convert" first')
+
+        if action in ('convert', 'list'):
+            for start, name in sorted(partitions.list_partitions().items()):
+                self.stdout.write(f'{name}: {start} - {partitions.get_bounds(start)[1]}')
+        elif action == 'create':
+            created = partitions.ensure_partitions(options['ahead'])
+            self.stdout.write(f'Created {len(created)} partitions: {", ".join(created) or "-"}')
+        elif action == 'drop-expired':
+            cutoff = timezone.now() - timezone.timedelta(days=options['days'])
+            removed = partitions.drop_expired_partitions(cutoff, detach=options['detach'] or None)
+            self.stdout.write(f'Removed {len(removed)} expired partitions: {", ".join(removed) or "-"}')
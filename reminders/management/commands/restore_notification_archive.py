@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from reminders import archive
+
+
+class Command(BaseCommand):
+    help = 'Restore archived notifications from an archive manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', help='Storage name of the manifest, e.g. notifications/20261018T061500Z-3f9c2a1b/manifest.json')
+
+    def handle(self, *args, **options):
+        try:
+            restored = archive.restore_archive(options['manifest'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(f'Restored {restored} notifications')
@@ -0,0 +1,24 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from reminders.delivery_engine import DeliveryEngine
+
+
+class Command(BaseCommand):
+    help = 'Run the asyncio notification delivery engine as a long-running process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lanes', type=int, help='Number of batches delivered concurrently')
+        parser.add_argument('--poll-interval', type=float, help='Seconds to wait when nothing is due')
+        parser.add_argument('--urgent-lanes', type=int, help='Number of lanes reserved for urgent notifications')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Starting notification delivery engine')
+        engine = DeliveryEngine()
+        try:
+            asyncio.run(engine.serve(
+                lanes=options['lanes'],
+                poll_interval=options['poll_interval'],
+                urgent_lanes=options['urgent_lanes']
+            ))
+        except KeyboardInterrupt:
+            self.stdout.write('Delivery engine stopped')
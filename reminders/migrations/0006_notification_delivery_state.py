@@ -0,0 +1,50 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_delivery_state(apps, schema_editor):
+    Notification = apps.get_model('reminders', 'Notification')
+    Notification.objects.filter(sent=True).update(status='sent')
+    Notification.objects.filter(sent=False).update(next_attempt_at=models.F('scheduled_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0005_notification_claim'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notification_due_idx',
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='last_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('dead', 'Dead Letter')], default='pending', max_length=10),
+        ),
+        migrations.RunPython(backfill_delivery_state, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='notification_due_idx'),
+        ),
+    ]
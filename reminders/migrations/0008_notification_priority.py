@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-18 05:57
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def backfill_priority(apps, schema_editor):
+    Notification = apps.get_model('reminders', 'Notification')
+    pending = Notification.objects.filter(status='pending')
+    for prefix, subtask_isnull in (('reminder__', True), ('subtask__', False)):
+        notifications = pending.filter(subtask__isnull=subtask_isnull)
+        urgent = Q(**{f'{prefix}priority': 'high'}) | Q(**{f'{prefix}is_flagged': True})
+        notifications.filter(urgent).update(priority=0)
+        notifications.exclude(urgent).filter(**{f'{prefix}priority__in': ['low', 'none']}).update(priority=2)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0007_delivery_attempt'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Urgent'), (1, 'Normal'), (2, 'Low')], default=1),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['status', 'priority', 'next_attempt_at'], name='notification_priority_due_idx'),
+        ),
+        migrations.RunPython(backfill_priority, migrations.RunPython.noop),
+    ]
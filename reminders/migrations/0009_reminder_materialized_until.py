@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0008_notification_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reminder',
+            name='materialized_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
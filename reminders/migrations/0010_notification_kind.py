@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:06
+
+from django.db import migrations, models
+
+
+def backfill_kind(apps, schema_editor):
+    Notification = apps.get_model('reminders', 'Notification')
+    Notification.objects.filter(subtask__isnull=False).update(kind='subtask')
+    Notification.objects.filter(subtask__isnull=True, title__startswith='Upcoming: ').update(kind='early')
+    Notification.objects.filter(title__startswith='Overdue: ').update(kind='overdue')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0009_reminder_materialized_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='kind',
+            field=models.CharField(choices=[('reminder', 'Reminder'), ('early', 'Early Reminder'), ('subtask', 'Subtask'), ('overdue', 'Overdue')], default='reminder', max_length=10),
+        ),
+        migrations.RunPython(backfill_kind, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-18 06:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0011_userprofile_timezone_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OverdueSweep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timezone', models.CharField(max_length=32, unique=True)),
+                ('last_swept', models.DateField()),
+            ],
+        ),
+    ]
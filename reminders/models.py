@@ -5,19 +5,49 @@ from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
 import pytz
 from datetime import datetime
+from .timezones import get_user_timezone
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     timezone = models.CharField(
         max_length=32,
         choices=[(tz, tz) for tz in pytz.common_timezones],
-        default='UTC'
+        default='UTC',
+        # The hourly overdue sweep selects users by timezone
+        db_index=True
     )
 
     def __str__(self):
         return self.user.username
     
 
+class TrackedFieldsMixin:
+    """
+    Remembers the field values a model was loaded with, so a save can tell
+    which fields actually changed (see reminders.signals).
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_changed_fields(self):
+        """Names (attnames) of the fields changed since loading, or None if the instance wasn't loaded"""
+        loaded_values = getattr(self, '_loaded_values', None)
+        if loaded_values is None:
+            return None
+        return {name for name, value in loaded_values.items() if getattr(self, name) != value}
+
+    def save(self, *args, **kwargs):
+        self.changed_fields = self.get_changed_fields()
+        super().save(*args, **kwargs)
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields
+        }
+
+
 class Tag(models.Model):
     name = models.CharField(max_length=50)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tags")
@@ -26,7 +56,7 @@ class Tag(models.Model):
         return self.name
     
     
-class Reminder(models.Model):
+class Reminder(TrackedFieldsMixin, models.Model):
     
     def reminder_image_path(instance, filename):
         """Generate a unique path for each uploaded image."""
@@ -65,6 +95,15 @@ class Reminder(models.Model):
         ('high', 'High'),
     ]
 
+    # Fields that change when or what the reminder's notifications are
+    SCHEDULE_FIELDS = {
+        'user_id', 'title', 'description', 'date', 'time', 'is_all_day',
+        'early_reminder', 'custom_early_reminder', 'repeat', 'repeat_end_date',
+        'custom_repeat_interval', 'is_completed',
+    }
+    # Fields that only change the notifications' dispatch priority
+    NOTIFICATION_PRIORITY_FIELDS = {'priority', 'is_flagged'}
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reminders')
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
@@ -88,6 +127,8 @@ class Reminder(models.Model):
     location = models.CharField(max_length=255, blank=True, null=True)
     tags = models.ManyToManyField(Tag, blank=True, related_name="reminders")
     image = models.ImageField(upload_to=reminder_image_path, blank=True, null=True)
+    # High-water mark: notifications of a recurring reminder exist up to this time
+    materialized_until = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -111,11 +152,7 @@ class Reminder(models.Model):
         utc_time = datetime.combine(self.date, time_part)
         utc_time = pytz.UTC.localize(utc_time)
         
-        try:
-            user_profile, created = UserProfile.objects.get_or_create(user=user, defaults={'timezone': 'UTC'})
-            user_timezone = pytz.timezone(user_profile.timezone)
-        except Exception:
-            user_timezone = pytz.UTC
+        user_timezone = get_user_timezone(user)
         
         local_time = utc_time.astimezone(user_timezone)
         return local_time
@@ -124,11 +161,7 @@ class Reminder(models.Model):
         """
         Set the reminder's date and time fields based on the provided local time.
         """    
-        try:
-            user_profile, created = UserProfile.objects.get_or_create(user=user, defaults={'timezone': 'UTC'})
-            user_timezone = pytz.timezone(user_profile.timezone)
-        except Exception:
-            user_timezone = pytz.UTC
+        user_timezone = get_user_timezone(user)
         
         if isinstance(local_time, str):
             try:
@@ -155,7 +188,10 @@ class Reminder(models.Model):
         self.save()
 
 
-class SubTask(models.Model):
+class SubTask(TrackedFieldsMixin, models.Model):
+    SCHEDULE_FIELDS = {'reminder_id', 'title', 'description', 'date', 'time', 'is_all_day', 'is_completed'}
+    NOTIFICATION_PRIORITY_FIELDS = {'priority', 'is_flagged'}
+
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True, null=True)
     date = models.DateField(null=True, blank=True)
@@ -221,14 +257,112 @@ class DeviceToken(models.Model):
 
 
 class Notification(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead Letter'),
+    ]
+
+    KIND_CHOICES = [
+        ('reminder', 'Reminder'),
+        ('early', 'Early Reminder'),
+        ('subtask', 'Subtask'),
+        ('overdue', 'Overdue'),
+    ]
+
+    # Dispatch priority; lower values are claimed first
+    PRIORITY_URGENT = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_LOW = 2
+    PRIORITY_CHOICES = [
+        (PRIORITY_URGENT, 'Urgent'),
+        (PRIORITY_NORMAL, 'Normal'),
+        (PRIORITY_LOW, 'Low'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notifications")
     reminder = models.ForeignKey(Reminder, on_delete=models.CASCADE, related_name="notifications")
     subtask = models.ForeignKey(SubTask, on_delete=models.CASCADE, related_name="notifications", null=True, blank=True)
     title = models.CharField(max_length=200)
     message = models.CharField(max_length=500)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='reminder')
     scheduled_time = models.DateTimeField()
     sent = models.BooleanField(default=False)
     sent_at = models.DateTimeField(null=True, blank=True)
+    # Delivery state: failed sends are retried with backoff until they are dead-lettered
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_NORMAL)
+    # Set while a dispatcher worker owns the notification (see NotificationService.claim_due_notifications)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    claimed_by = models.CharField(max_length=255, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='notification_due_idx'),
+            models.Index(fields=['status', 'priority', 'next_attempt_at'], name='notification_priority_due_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.scheduled_time}"
+
+    def save(self, *args, **kwargs):
+        # The first delivery attempt happens at the scheduled time
+        if self.next_attempt_at is None and self.status == 'pending':
+            self.next_attempt_at = self.scheduled_time
+        if self._state.adding:
+            self.priority = Notification.priority_for(self.subtask or self.reminder)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def priority_for(cls, item):
+        """Dispatch priority for a reminder or subtask: high priority and flagged items are urgent"""
+        if item.priority == 'high' or item.is_flagged:
+            return cls.PRIORITY_URGENT
+        if item.priority == 'medium':
+            return cls.PRIORITY_NORMAL
+        return cls.PRIORITY_LOW
+
+
+class DeliveryAttempt(models.Model):
+    """
+    Outbox row for one delivery of a notification on one channel and device.
+
+    Rows are written before anything is sent and acknowledged afterwards, so
+    a dispatcher that restarts after a crash can tell which sends already
+    went out instead of repeating them.
+    """
+    CHANNEL_CHOICES = [
+        ('push', 'Push'),
+        ('email', 'Email'),
+    ]
+
+    STATUS_CHOICES = [
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name="delivery_attempts")
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    device = models.ForeignKey(DeviceToken, on_delete=models.SET_NULL, related_name="delivery_attempts", null=True, blank=True)
+    idempotency_key = models.CharField(max_length=100, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='sending')
+    attempts = models.PositiveIntegerField(default=1)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.idempotency_key} ({self.status})"
+
+
+class OverdueSweep(models.Model):
+    """The last local day check_overdue_items_by_timezone swept a timezone for"""
+    timezone = models.CharField(max_length=32, unique=True)
+    last_swept = models.DateField()
+
+    def __str__(self):
+        return f"{self.timezone}: {self.last_swept}"
@@ -1,326 +1,1035 @@
+import itertools
+import os
+import random
+import socket
+import uuid
 from django.utils import timezone
-from datetime import timedelta
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.core.mail import EmailMultiAlternatives
+from django.core.mail.utils import DNS_NAME
 from django.conf import settings
-from firebase_admin import messaging
-from .models import Reminder, Notification, DeviceToken
+from firebase_admin import exceptions as firebase_exceptions, messaging
+from .models import Reminder, SubTask, Notification, DeliveryAttempt, DeviceToken
+from .email_sender import EmailBatchSender
+from . import digest, email_templates, outbox, rate_limit, recurrence, timing_wheel
+
+# Maximum number of messages FCM accepts in a single send_each call
+FCM_BATCH_SIZE = 500
 
 class NotificationService:
     @staticmethod
-    def schedule_notifications_for_reminder(reminder):
-        """Schedule notifications for a reminder based on its early reminder setting"""
-        Notification.objects.filter(reminder=reminder).delete()
-        
+    def schedule_notifications_for_reminder(reminder, window_days=None):
+        """
+        Schedule notifications for a reminder based on its early reminder setting.
+
+        The desired notifications (the reminder itself, its early reminder and
+        the rolling window of a recurring reminder's next occurrences) are
+        diffed against the reminder's pending ones and only the difference is
+        written. Sent history is kept; once the reminder is completed or loses
+        its date, the pending notifications of its subtasks and its overdue
+        notifications are removed as well.
+        """
+        now = timezone.now()
+        desired = []
+        high_water_mark = None
+
         # If no date/time or reminder is completed, don't schedule
-        if not reminder.date or reminder.is_completed:
-            return
-        
-        # Calculate notification time based on reminder settings
-        reminder_datetime = None
-        
-        if reminder.time:
-            # Combine date and time
-            reminder_datetime = timezone.make_aware(
-                timezone.datetime.combine(reminder.date, reminder.time)
+        if reminder.date and not reminder.is_completed:
+            reminder_datetime = NotificationService.get_reminder_datetime(reminder)
+            occurrences, high_water_mark = NotificationService.get_upcoming_occurrences(
+                reminder, now, window_days, now
             )
+            desired = NotificationService.build_reminder_notifications(reminder, [reminder_datetime] + occurrences)
         else:
-            # All-day reminder, default to 9:00 AM
-            reminder_datetime = timezone.make_aware(
-                timezone.datetime.combine(reminder.date, timezone.datetime.min.time().replace(hour=9))
-            )
-        
-        # Schedule the main notification
-        Notification.objects.create(
-            user=reminder.user,
-            reminder=reminder,
-            title=reminder.title,
-            message=reminder.description or "Time for your reminder!",
-            scheduled_time=reminder_datetime
+            Notification.objects.filter(
+                reminder=reminder, kind__in=['subtask', 'overdue'], status='pending'
+            ).exclude(claimed_at__gte=NotificationService.get_claim_cutoff(now)).delete()
+
+        if reminder.repeat != 'never' and reminder.materialized_until != high_water_mark:
+            reminder.materialized_until = high_water_mark
+            # Update the mark directly so the post_save signal doesn't reschedule again
+            Reminder.objects.filter(pk=reminder.pk).update(materialized_until=high_water_mark)
+
+        return NotificationService.sync_notifications(
+            Notification.objects.filter(reminder=reminder, kind__in=['reminder', 'early']),
+            desired
         )
-        
-        # Schedule early reminder if set
-        if reminder.early_reminder != 'none':
-            early_time = None
-            
-            if reminder.early_reminder == 'custom' and reminder.custom_early_reminder:
-                early_time = reminder_datetime - reminder.custom_early_reminder
-            else:
-                delta_mapping = {
-                    '5min': timedelta(minutes=5),
-                    '10min': timedelta(minutes=15),
-                }
-                
-                if reminder.early_reminder in delta_mapping:
-                    early_time = reminder_datetime - delta_mapping[reminder.early_reminder]
-            
-            if early_time:
-                Notification.objects.create(
-                    user=reminder.user,
+
+    @staticmethod
+    def get_reminder_datetime(item):
+        """When a reminder or subtask is due; all-day items default to 9:00 AM"""
+        if item.time:
+            return timezone.make_aware(timezone.datetime.combine(item.date, item.time))
+        return timezone.make_aware(
+            timezone.datetime.combine(item.date, timezone.datetime.min.time().replace(hour=9))
+        )
+
+    @staticmethod
+    def get_early_reminder_offset(reminder):
+        """How long before each occurrence the early reminder fires, or None"""
+        if reminder.early_reminder == 'custom':
+            return reminder.custom_early_reminder or None
+
+        delta_mapping = {
+            '5min': timedelta(minutes=5),
+            '10min': timedelta(minutes=15),
+        }
+        return delta_mapping.get(reminder.early_reminder)
+
+    @staticmethod
+    def build_reminder_notifications(reminder, occurrences):
+        """
+        Build (unsaved) notifications for the given occurrence times of a reminder.
+
+        next_attempt_at and priority are set explicitly, since bulk_create
+        skips Notification.save().
+        """
+        priority = Notification.priority_for(reminder)
+        early_offset = NotificationService.get_early_reminder_offset(reminder)
+        notifications = []
+
+        for index, occurrence in enumerate(occurrences):
+            notifications.append(Notification(
+                user_id=reminder.user_id,
+                reminder=reminder,
+                kind='reminder',
+                title=reminder.title,
+                message=reminder.description or "Time for your reminder!",
+                scheduled_time=occurrence,
+                next_attempt_at=occurrence,
+                priority=priority
+            ))
+
+            # Hourly repeats already fire every hour, so only the first
+            # occurrence gets an early reminder
+            if early_offset and (index == 0 or reminder.repeat != 'hourly'):
+                notifications.append(Notification(
+                    user_id=reminder.user_id,
                     reminder=reminder,
+                    kind='early',
                     title=f"Upcoming: {reminder.title}",
                     message=f"Reminder coming up {reminder.get_early_reminder_display()}",
-                    scheduled_time=early_time
-                )
-    
+                    scheduled_time=occurrence - early_offset,
+                    next_attempt_at=occurrence - early_offset,
+                    priority=priority
+                ))
+
+        return notifications
+
     @staticmethod
-    def schedule_recurring_reminders(reminder, future_days=90):
-        """Schedule future instances of recurring reminders"""
-        if reminder.repeat == 'never' or not reminder.date:
-            return []
-        
-        end_date = reminder.repeat_end_date or (timezone.now().date() + timedelta(days=future_days))
-        
-        if reminder.repeat_end_date and reminder.date > reminder.repeat_end_date:
-            return []
-        
-        # Calculate next dates based on repeat pattern
-        next_dates = []
-        current_date = reminder.date
-        
-        while current_date <= end_date:
-            # Add the next date based on repeat type
-            if reminder.repeat == 'daily':
-                current_date += timedelta(days=1)
-            elif reminder.repeat == 'weekdays':
-                current_date += timedelta(days=1)
-                # Skip weekends
-                while current_date.weekday() >= 5:  
-                    current_date += timedelta(days=1)
-            elif reminder.repeat == 'weekends':
-                current_date += timedelta(days=1)
-                # Skip weekdays
-                while current_date.weekday() < 5: 
-                    current_date += timedelta(days=1)
-            elif reminder.repeat == 'weekly':
-                current_date += timedelta(weeks=1)
-            elif reminder.repeat == 'biweekly':
-                current_date += timedelta(weeks=2)
-            elif reminder.repeat == 'monthly':
-                month = current_date.month + 1
-                year = current_date.year
-                if month > 12:
-                    month = 1
-                    year += 1
-                
-                # Handle month length differences
-                day = min(current_date.day, [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
-                current_date = current_date.replace(year=year, month=month, day=day)
-            elif reminder.repeat == 'quarterly':
-                # Move 3 months ahead
-                month = current_date.month + 3
-                year = current_date.year
-                while month > 12:
-                    month -= 12
-                    year += 1
-                
-                # Handle month length differences
-                day = min(current_date.day, [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
-                current_date = current_date.replace(year=year, month=month, day=day)
-            elif reminder.repeat == 'biannually':
-                # Move 6 months ahead
-                month = current_date.month + 6
-                year = current_date.year
-                if month > 12:
-                    month -= 12
-                    year += 1
-                
-                # Handle month length differences
-                day = min(current_date.day, [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
-                current_date = current_date.replace(year=year, month=month, day=day)
-            elif reminder.repeat == 'yearly':
-                current_date = current_date.replace(year=current_date.year + 1)
-            elif reminder.repeat == 'hourly':
-                # For hourly, we'll add notifications within the same day
-                if reminder.time:
-                    # Add only the first few hourly reminders to avoid creating too many
-                    reminder_datetime = timezone.make_aware(
-                        timezone.datetime.combine(current_date, reminder.time)
-                    )
-                    for i in range(1, min(24, future_days)):
-                        next_datetime = reminder_datetime + timedelta(hours=i)
-                        # Only add if it's on the same day
-                        if next_datetime.date() == current_date:
-                            Notification.objects.create(
-                                user=reminder.user,
-                                reminder=reminder,
-                                title=reminder.title,
-                                message=reminder.description or "Time for your reminder!",
-                                scheduled_time=next_datetime
-                            )
-                # Move to next day for the hourly pattern
-                current_date += timedelta(days=1)
-                continue
-            elif reminder.repeat == 'custom' and reminder.custom_repeat_interval:
-                # Handle custom repeat patterns
-                interval = reminder.custom_repeat_interval
-                
-                if 'days' in interval:
-                    current_date += timedelta(days=interval['days'])
-                elif 'weeks' in interval:
-                    current_date += timedelta(weeks=interval['weeks'])
-                elif 'months' in interval:
-                    # Move X months ahead
-                    month = current_date.month + interval['months']
-                    year = current_date.year
-                    while month > 12:
-                        month -= 12
-                        year += 1
-                    
-                    # Handle month length differences
-                    day = min(current_date.day, [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
-                    current_date = current_date.replace(year=year, month=month, day=day)
-                else:
-                    # Default to daily if custom pattern is invalid
-                    current_date += timedelta(days=1)
+    def sync_notifications(existing, desired):
+        """
+        Apply the difference between pending notifications and the desired ones.
+
+        Rows are matched per kind: a row already at a desired time is kept
+        (and updated only if its content changed), leftover pending rows are
+        moved to the leftover desired times, and the rest are inserted or
+        deleted, each with one bulk query. Sent and dead-lettered rows are
+        history: they are never changed, and a desired notification they
+        already cover isn't created again. Pending rows a dispatcher has
+        claimed are treated the same until the claim goes stale, since the
+        dispatcher marks them by id when it's done. A row moved to a new
+        time loses its delivery attempts, since the outbox keys sends by
+        notification id and would skip the new occurrence. Returns the
+        number of rows created, updated and deleted.
+        """
+        fields = ['title', 'message', 'scheduled_time', 'next_attempt_at', 'priority', 'attempts', 'last_error']
+        claim_cutoff = NotificationService.get_claim_cutoff()
+        existing_by_kind = {}
+        delivered = set()
+        for notification in existing.order_by('scheduled_time'):
+            in_flight = notification.claimed_at is not None and notification.claimed_at >= claim_cutoff
+            if notification.status == 'pending' and not in_flight:
+                existing_by_kind.setdefault(notification.kind, []).append(notification)
             else:
-                # Default for any unhandled repeat types
-                break
-            
-            # Add to list of next dates if within the end date
-            if current_date <= end_date:
-                next_dates.append(current_date)
-        
-        return next_dates
+                delivered.add((notification.kind, notification.scheduled_time))
+        desired_by_kind = {}
+        for notification in sorted(desired, key=lambda n: n.scheduled_time):
+            if (notification.kind, notification.scheduled_time) not in delivered:
+                desired_by_kind.setdefault(notification.kind, []).append(notification)
+
+        to_create, to_update, to_delete = [], [], []
+        moved_ids = []
+        for kind in set(existing_by_kind) | set(desired_by_kind):
+            rows_by_time = {}
+            for row in existing_by_kind.get(kind, []):
+                rows_by_time.setdefault(row.scheduled_time, []).append(row)
+
+            unmatched = []
+            for notification in desired_by_kind.get(kind, []):
+                rows = rows_by_time.get(notification.scheduled_time)
+                if not rows:
+                    unmatched.append(notification)
+                    continue
+
+                row = rows.pop(0)
+                if any(getattr(row, field) != getattr(notification, field) for field in ['title', 'message', 'priority']):
+                    row.title = notification.title
+                    row.message = notification.message
+                    row.priority = notification.priority
+                    to_update.append(row)
+
+            leftover = sorted((row for rows in rows_by_time.values() for row in rows), key=lambda row: row.scheduled_time)
+            for row, notification in zip(leftover, unmatched):
+                # Moved to a new time, so it starts over as a fresh delivery
+                row.title = notification.title
+                row.message = notification.message
+                row.priority = notification.priority
+                row.scheduled_time = notification.scheduled_time
+                row.next_attempt_at = notification.scheduled_time
+                row.attempts = 0
+                row.last_error = ''
+                to_update.append(row)
+                moved_ids.append(row.id)
+
+            to_delete.extend(leftover[len(unmatched):])
+            to_create.extend(unmatched[len(leftover):])
+
+        if to_delete:
+            Notification.objects.filter(id__in=[row.id for row in to_delete]).delete()
+        if to_update:
+            Notification.objects.bulk_update(to_update, fields)
+        if moved_ids:
+            DeliveryAttempt.objects.filter(notification_id__in=moved_ids).delete()
+        if to_create:
+            to_create = Notification.objects.bulk_create(to_create)
+
+        timing_wheel.schedule_on_commit(to_update + to_create)
+        return {'created': len(to_create), 'updated': len(to_update), 'deleted': len(to_delete)}
+
+    @staticmethod
+    def update_notification_priority(item):
+        """
+        Re-derive the dispatch priority of a reminder's or subtask's pending notifications.
+
+        Used when only the priority or flag changed, so nothing needs to be
+        rescheduled. Returns the number of notifications updated.
+        """
+        if isinstance(item, SubTask):
+            pending = Notification.objects.filter(subtask=item, status='pending')
+        else:
+            pending = Notification.objects.filter(reminder=item, subtask__isnull=True, status='pending')
+        priority = Notification.priority_for(item)
+        return pending.exclude(priority=priority).update(priority=priority)
+
+    @staticmethod
+    def schedule_recurring_reminders(reminder, future_days=None):
+        """Reschedule a recurring reminder's notifications, including its rolling window"""
+        return NotificationService.schedule_notifications_for_reminder(reminder, future_days)
+
+    @staticmethod
+    def get_upcoming_occurrences(reminder, after, window_days=None, now=None):
+        """
+        Return the recurring reminder's occurrence times after `after`, and the new high-water mark.
+
+        Occurrences are limited to the next window_days days
+        (NOTIFICATION_RECURRENCE_WINDOW_DAYS by default), to
+        NOTIFICATION_RECURRENCE_MAX_OCCURRENCES and to the repeat end date.
+        """
+        now = now or timezone.now()
+        window_days = window_days or getattr(settings, 'NOTIFICATION_RECURRENCE_WINDOW_DAYS', 7)
+        max_occurrences = getattr(settings, 'NOTIFICATION_RECURRENCE_MAX_OCCURRENCES', 100)
+
+        window_end = now + timedelta(days=window_days)
+        if reminder.repeat_end_date:
+            end_of_repeat = timezone.make_aware(
+                timezone.datetime.combine(reminder.repeat_end_date + timedelta(days=1), timezone.datetime.min.time())
+            )
+            window_end = min(window_end, end_of_repeat)
+
+        after = max(after, now)
+        rule = None if reminder.is_completed else recurrence.compile_rule(reminder)
+        occurrences = []
+
+        if rule is not None and after < window_end:
+            # Start from the occurrences on the day of `after` and skip the
+            # ones at or before it
+            n = rule.count_through(timezone.localtime(after).date() - timedelta(days=1)) + 1
+            while len(occurrences) < max_occurrences:
+                occurrence = NotificationService.get_occurrence_time(reminder, rule.nth(n))
+                if occurrence > window_end:
+                    break
+                if occurrence > after:
+                    occurrences.append(occurrence)
+                n += 1
+
+        high_water_mark = occurrences[-1] if len(occurrences) == max_occurrences else window_end
+        return occurrences, max(high_water_mark, after)
+
+    @staticmethod
+    def materialize_recurring_notifications(reminder, window_days=None, now=None):
+        """
+        Create notifications for a recurring reminder's next occurrences.
+
+        Only occurrences after the reminder's high-water mark (materialized_until)
+        and within the rolling window are created, then the mark is moved
+        forward. Calling this again only adds what is new, so
+        reschedule_recurring_reminders only needs to revisit reminders whose
+        window is about to run out.
+        """
+        return NotificationService.materialize_recurring_batch([reminder], window_days, now)
+
+    @staticmethod
+    def materialize_recurring_batch(reminders, window_days=None, now=None):
+        """
+        Materialize the rolling window of several recurring reminders with bulk writes.
+
+        The new notifications of all reminders are inserted with one
+        bulk_create and their high-water marks moved with one bulk_update
+        (which doesn't send post_save, so nothing is rescheduled again).
+        Returns the created notifications.
+        """
+        now = now or timezone.now()
+        notifications = []
+
+        for reminder in reminders:
+            occurrences, reminder.materialized_until = NotificationService.get_upcoming_occurrences(
+                reminder, reminder.materialized_until or now, window_days, now
+            )
+            created = NotificationService.build_reminder_notifications(reminder, occurrences)
+            if reminder.repeat == 'hourly':
+                # The early reminder belongs to the reminder's own first occurrence
+                created = [notification for notification in created if notification.kind == 'reminder']
+            notifications.extend(created)
+
+        Reminder.objects.bulk_update(reminders, ['materialized_until'])
+
+        if not notifications:
+            return []
+
+        notifications = Notification.objects.bulk_create(notifications)
+        timing_wheel.schedule_on_commit(notifications)
+        return notifications
+
+    @staticmethod
+    def get_occurrence_time(reminder, occurrence):
+        """When an occurrence fires: hourly rules yield datetimes, the others dates at the reminder's time"""
+        if isinstance(occurrence, datetime):
+            return occurrence
+
+        occurrence_time = reminder.time or timezone.datetime.min.time().replace(hour=9)
+        return timezone.make_aware(timezone.datetime.combine(occurrence, occurrence_time))
     
     @staticmethod
     def schedule_notifications_for_subtask(subtask):
-        """Schedule notifications for a subtask based on its date/time"""
-        Notification.objects.filter(subtask=subtask).delete()
-        
+        """
+        Schedule notifications for a subtask based on its date/time.
+
+        Once the subtask is completed or loses its date, its pending overdue
+        notification is removed as well.
+        """
+        desired = []
+
         # If no date/time or subtask is completed, don't schedule
-        if not subtask.date or subtask.is_completed:
-            return
-        
-        # Calculate notification time based on subtask settings
-        subtask_datetime = None
-        
-        if subtask.time:
-            subtask_datetime = timezone.make_aware(
-                timezone.datetime.combine(subtask.date, subtask.time)
-            )
+        if subtask.date and not subtask.is_completed:
+            subtask_datetime = NotificationService.get_reminder_datetime(subtask)
+            desired.append(Notification(
+                user=subtask.reminder.user,
+                reminder=subtask.reminder,
+                subtask=subtask,
+                kind='subtask',
+                title=f"Subtask: {subtask.title}",
+                message=subtask.description or "Time for your subtask!",
+                scheduled_time=subtask_datetime,
+                next_attempt_at=subtask_datetime,
+                priority=Notification.priority_for(subtask)
+            ))
         else:
-            # All-day subtask, default to 9:00 AM
-            subtask_datetime = timezone.make_aware(
-                timezone.datetime.combine(subtask.date, timezone.datetime.min.time().replace(hour=9))
+            Notification.objects.filter(
+                subtask=subtask, kind='overdue', status='pending'
+            ).exclude(claimed_at__gte=NotificationService.get_claim_cutoff()).delete()
+
+        return NotificationService.sync_notifications(
+            Notification.objects.filter(subtask=subtask, kind='subtask'),
+            desired
+        )
+
+    @staticmethod
+    def create_overdue_notifications(reminders, subtasks, today, now=None, day_start=None):
+        """
+        Create today's overdue notifications for the given reminders and subtasks.
+
+        Items that already have an overdue notification scheduled today are
+        left out by a NOT EXISTS anti-join, the rest are streamed and inserted
+        with one bulk_create per NOTIFICATION_OVERDUE_CHUNK_SIZE items.
+        day_start is when "today" began (midnight in the server's timezone by
+        default); when given, the days overdue are counted in its timezone
+        from the items' UTC date and time, otherwise from their date. Returns
+        the number of notifications created.
+        """
+        now = now or timezone.now()
+        local_timezone = day_start.tzinfo if day_start else None
+        day_start = day_start or timezone.make_aware(timezone.datetime.combine(today, timezone.datetime.min.time()))
+        notified_today = Notification.objects.filter(kind='overdue', scheduled_time__gte=day_start)
+
+        reminders = reminders.annotate(
+            notified=Exists(notified_today.filter(reminder=OuterRef('pk'), subtask__isnull=True))
+        ).filter(notified=False).only('user_id', 'title', 'date', 'time', 'priority', 'is_flagged')
+        subtasks = subtasks.annotate(
+            notified=Exists(notified_today.filter(subtask=OuterRef('pk')))
+        ).filter(notified=False).select_related('reminder').only(
+            'title', 'date', 'time', 'priority', 'is_flagged', 'reminder__user_id'
+        )
+
+        def build(item, user_id, reminder_id, subtask_id, label):
+            due_date = item.date
+            if local_timezone:
+                due = datetime.combine(item.date, item.time or datetime.min.time(), tzinfo=dt_timezone.utc)
+                due_date = due.astimezone(local_timezone).date()
+            days_overdue = (today - due_date).days
+            overdue_text = "yesterday" if days_overdue == 1 else f"{days_overdue} days ago"
+            return Notification(
+                user_id=user_id,
+                reminder_id=reminder_id,
+                subtask_id=subtask_id,
+                kind='overdue',
+                title=f"Overdue: {item.title}",
+                message=f"This {label} was due {overdue_text}",
+                scheduled_time=now,
+                next_attempt_at=now,
+                priority=Notification.priority_for(item)
             )
-        
-        # Schedule the main notification
-        Notification.objects.create(
-            user=subtask.reminder.user,
-            reminder=subtask.reminder,
-            subtask=subtask,
-            title=f"Subtask: {subtask.title}",
-            message=subtask.description or "Time for your subtask!",
-            scheduled_time=subtask_datetime
+
+        notifications = itertools.chain(
+            (build(reminder, reminder.user_id, reminder.id, None, 'reminder') for reminder in reminders.iterator()),
+            (build(subtask, subtask.reminder.user_id, subtask.reminder_id, subtask.id, 'subtask')
+             for subtask in subtasks.iterator())
         )
 
+        chunk_size = getattr(settings, 'NOTIFICATION_OVERDUE_CHUNK_SIZE', 1000)
+        created = 0
+        while True:
+            chunk = list(itertools.islice(notifications, chunk_size))
+            if not chunk:
+                return created
+            chunk = Notification.objects.bulk_create(chunk)
+            timing_wheel.schedule_on_commit(chunk)
+            created += len(chunk)
+
+    @staticmethod
+    def get_claim_cutoff(now=None):
+        """Claims made before this are considered abandoned (NOTIFICATION_CLAIM_TIMEOUT)"""
+        now = now or timezone.now()
+        return now - timedelta(seconds=getattr(settings, 'NOTIFICATION_CLAIM_TIMEOUT', 300))
+
     @staticmethod
-    def send_due_notifications():
-        """Send notifications that are due now"""
+    def get_worker_id():
+        """Build an identifier for the current dispatcher process"""
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def claim_due_notifications(worker_id, batch_size=None, now=None, notification_ids=None, priorities=None):
+        """
+        Claim a batch of due notifications for a single dispatcher worker.
+
+        Candidate rows are locked with SELECT ... FOR UPDATE SKIP LOCKED, so
+        concurrent workers always receive disjoint batches, and are stamped as
+        in-flight before the transaction commits. Claims older than
+        NOTIFICATION_CLAIM_TIMEOUT seconds are considered abandoned (e.g. the
+        worker crashed) and can be claimed again. notification_ids restricts
+        the claim to specific rows, e.g. ids popped from the timing wheel.
+
+        Urgent notifications are claimed first and low priority ones last, so
+        under load it is the low priority backlog that waits. priorities
+        restricts the claim to some priorities, e.g. for a reserved urgent lane.
+        """
+        now = now or timezone.now()
+        batch_size = batch_size or getattr(settings, 'NOTIFICATION_DISPATCH_BATCH_SIZE', 100)
+        stale_before = NotificationService.get_claim_cutoff(now)
+
+        candidates = Notification.objects.filter(status='pending', next_attempt_at__lte=now)
+        if notification_ids is not None:
+            candidates = candidates.filter(id__in=notification_ids)
+        if priorities is not None:
+            candidates = candidates.filter(priority__in=priorities)
+
+        with transaction.atomic():
+            claimed_ids = list(
+                candidates.select_for_update(skip_locked=True)
+                .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=stale_before))
+                .order_by('priority', 'next_attempt_at')
+                .values_list('id', flat=True)[:batch_size]
+            )
+
+            if not claimed_ids:
+                return []
+
+            Notification.objects.filter(id__in=claimed_ids).update(
+                claimed_at=now,
+                claimed_by=worker_id
+            )
+
+        return list(
+            Notification.objects.filter(id__in=claimed_ids, claimed_by=worker_id)
+            .select_related('user', 'reminder', 'subtask')
+            .order_by('priority', 'scheduled_time')
+        )
+
+    @staticmethod
+    def send_due_notifications(worker_id=None, batch_size=None, max_batches=None, priorities=None):
+        """
+        Send notifications that are due now.
+
+        Several workers can run this at the same time: each one repeatedly
+        claims a disjoint batch, delivers it and records the outcome, until no
+        due notifications are left (or max_batches is reached). Returns the
+        number of batches delivered, of notifications deferred by the rate
+        limiter and of invalid device tokens pruned. priorities restricts the
+        run to some dispatch priorities (see claim_due_notifications).
+        """
+        worker_id = worker_id or NotificationService.get_worker_id()
+
+        if getattr(settings, 'NOTIFICATION_DELIVERY_BACKEND', 'sync') == 'async':
+            from .delivery_engine import DeliveryEngine
+            return DeliveryEngine.dispatch(worker_id, batch_size, max_batches, priorities)
+
+        stats = {'batches': 0, 'deferred': 0, 'pruned_tokens': 0}
+        # Active device tokens per user id, shared by every batch of the run
+        token_cache = {}
+
+        # One SMTP connection is reused for every email of the dispatch run
+        with EmailBatchSender() as email_sender:
+            while max_batches is None or stats['batches'] < max_batches:
+                batch = NotificationService.claim_due_notifications(worker_id, batch_size, priorities=priorities)
+                if not batch:
+                    break
+
+                outcome = NotificationService.deliver_batch(batch, email_sender, token_cache)
+                stats['batches'] += 1
+                stats['deferred'] += outcome['deferred']
+                stats['pruned_tokens'] += outcome['pruned_tokens']
+
+                # Providers are at their rate limit; leave the rest for the next run
+                if outcome['deferred'] == len(batch):
+                    break
+
+        if stats['pruned_tokens']:
+            print(f"Deactivated {stats['pruned_tokens']} invalid device tokens")
+
+        return stats
+
+    @staticmethod
+    def deliver_batch(batch, email_sender, token_cache=None):
+        """
+        Send push and email for a claimed batch, then record the outcome.
+
+        Returns how many notifications the rate limiter deferred and how many
+        device tokens were deactivated because FCM reported them invalid.
+        """
+        errors = {}
+        invalid_device_ids = set()
+
+        targets = NotificationService.prepare_push_targets(batch, token_cache)
+        batch, targets, deferred = NotificationService.apply_rate_limits(batch, targets)
+
+        # Phase one: reserve every send in the outbox, skipping sends an
+        # earlier run already made before it could record the outcome
+        targets, email_batch, delivered = outbox.reserve(
+            targets,
+            [notification for notification in batch if NotificationService.wants_email(notification)]
+        )
+
+        results = []
+        push_results = {}
+        if targets:
+            results = NotificationService.send_messages(targets)
+            push_results = NotificationService.record_push_results(results, errors, invalid_device_ids)
+
+        email_results = NotificationService.send_email_batch(email_batch, email_sender, errors)
+
+        # Phase two: acknowledge the sends, then record the notification outcome
+        outbox.acknowledge(results, email_results, errors)
+        push_results.update(dict.fromkeys(delivered['push'], True))
+        email_results.update(dict.fromkeys(delivered['email'], True))
+        NotificationService.finish_batch(batch, push_results, email_results, errors)
+
+        return {
+            'deferred': deferred,
+            'pruned_tokens': NotificationService.prune_device_tokens(invalid_device_ids, token_cache),
+        }
+
+    @staticmethod
+    def apply_rate_limits(batch, targets):
+        """
+        Admit as much of a batch as the per-channel rate limits allow.
+
+        The batch is admitted in delivery units (see get_delivery_units), in
+        order, while both the FCM and SMTP buckets can cover all of the unit's
+        messages: a digest costs one push per device and one email, however
+        many notifications it covers. The rest are deferred (not dropped) and
+        picked up again once the buckets have refilled. Returns the admitted
+        notifications, their push targets and the deferred count.
+        """
+        if not rate_limit.is_enabled():
+            return batch, targets, 0
+
+        units = NotificationService.get_delivery_units(batch)
+        messages_by_id = {}
+        for notification, _, message in targets:
+            messages_by_id.setdefault(notification.id, set()).add(id(message))
+
+        push_needed = []
+        email_needed = []
+        for unit in units:
+            # Notifications of a digest share its messages, which are counted once
+            push_needed.append(len(set().union(*(messages_by_id.get(n.id, set()) for n in unit))))
+            email_needed.append(len(digest.group([n for n in unit if NotificationService.wants_email(n)])))
+
+        limiter = rate_limit.RateLimiter()
+        push_budget = limiter.acquire('fcm', sum(push_needed))
+        email_budget = limiter.acquire('smtp', sum(email_needed))
+
+        admitted = []
+        deferred = []
+        push_deferred = 0
+        email_deferred = 0
+        for unit, push_cost, email_cost in zip(units, push_needed, email_needed):
+            if not deferred and push_cost <= push_budget and email_cost <= email_budget:
+                push_budget -= push_cost
+                email_budget -= email_cost
+                admitted.extend(unit)
+            else:
+                deferred.extend(unit)
+                push_deferred += push_cost
+                email_deferred += email_cost
+
+        if deferred:
+            limiter.refund('fcm', push_budget)
+            limiter.refund('smtp', email_budget)
+
+            delay = max(
+                limiter.retry_after('fcm', push_deferred),
+                limiter.retry_after('smtp', email_deferred),
+                1
+            )
+            NotificationService.defer_notifications(deferred, timedelta(seconds=delay))
+
+        admitted_ids = {notification.id for notification in admitted}
+        admitted = [notification for notification in batch if notification.id in admitted_ids]
+        admitted_targets = [target for target in targets if target[0].id in admitted_ids]
+        return admitted, admitted_targets, len(deferred)
+
+    @staticmethod
+    def get_delivery_units(batch):
+        """
+        Split a batch into the units the rate limiter admits or defers as a whole.
+
+        Notifications that may be coalesced into one digest, on either
+        channel, share a unit, so a digest is never sent for part of its
+        notifications; without digests every notification is its own unit.
+        Units are ordered by their first notification in the batch, so they
+        keep the batch's priority order.
+        """
+        units = {notification.id: [notification] for notification in batch}
+        runs = (
+            digest.runs([n for n in batch if NotificationService.wants_push(n)])
+            + digest.runs([n for n in batch if NotificationService.wants_email(n)])
+        )
+        for run in runs:
+            merged = []
+            for unit in {id(units[n.id]): units[n.id] for n in run}.values():
+                merged.extend(unit)
+            for notification in merged:
+                units[notification.id] = merged
+
+        position = {notification.id: index for index, notification in enumerate(batch)}
+        ordered = []
+        seen = set()
+        for notification in batch:
+            unit = units[notification.id]
+            if id(unit) not in seen:
+                seen.add(id(unit))
+                ordered.append(sorted(unit, key=lambda n: position[n.id]))
+        return ordered
+
+    @staticmethod
+    def defer_notifications(notifications, delay):
+        """Release claimed notifications and push their next attempt back without counting a failure"""
+        next_attempt_at = timezone.now() + delay
+        Notification.objects.filter(id__in=[notification.id for notification in notifications]).update(
+            next_attempt_at=next_attempt_at,
+            claimed_at=None,
+            claimed_by=''
+        )
+
+        for notification in notifications:
+            notification.next_attempt_at = next_attempt_at
+        timing_wheel.schedule_on_commit(notifications)
+
+    @staticmethod
+    def wants_push(notification):
+        """Whether a notification should be delivered by push"""
+        return notification.reminder.notification_preference in ['push', 'both']
+
+    @staticmethod
+    def wants_email(notification):
+        """Whether a notification should be delivered by email"""
+        return (
+            notification.reminder.notification_preference in ['email', 'both']
+            and bool(notification.user.email)
+        )
+
+    @staticmethod
+    def send_email_batch(notifications, email_sender, errors=None):
+        """
+        Send the emails for a batch of notifications over the sender's pooled connection.
+
+        A user's notifications that are due together may be coalesced into a
+        single digest email (see reminders.digest).
+
+        Returns a dict mapping notification id to whether its email was sent;
+        failures are recorded in errors (notification id to message).
+        """
+        errors = {} if errors is None else errors
+        groups = digest.group([
+            notification for notification in notifications
+            if NotificationService.wants_email(notification)
+        ])
+
+        contexts = []
+        for group in groups:
+            entries = []
+            for notification in group:
+                subtask = notification.subtask
+                item = subtask if subtask else notification.reminder
+                item_type = "subtask" if subtask else "reminder"
+                entries.append((notification.title, notification.message, item, item_type))
+
+            if len(group) > 1:
+                contexts.append(email_templates.build_digest_context(entries))
+            else:
+                contexts.append(email_templates.build_context(*entries[0]))
+
+        pending = [
+            (group, NotificationService.create_email_message(
+                group[0].user.email,
+                rendered,
+                message_id=f"<{outbox.email_key(group[0].id)}@{DNS_NAME}>"
+            ))
+            for group, rendered in zip(groups, email_templates.render_email_batch(contexts))
+        ]
+        results = email_sender.send_messages([email_message for _, email_message in pending])
+
+        email_results = {}
+        for (group, _), (sent, error) in zip(pending, results):
+            for notification in group:
+                email_results[notification.id] = sent
+                if not sent:
+                    errors[notification.id] = f"email: {error}"
+
+        return email_results
+
+    @staticmethod
+    def finish_batch(batch, push_results, email_results, errors):
+        """
+        Record the outcome of a delivered batch and release its dispatcher claim.
+
+        Notifications delivered on at least one channel are marked as sent in a
+        single update. Failed ones are retried on a jittered exponential backoff
+        and dead-lettered after NOTIFICATION_RETRY_MAX_ATTEMPTS attempts, or
+        straight away when there was no channel to deliver them on.
+        """
         now = timezone.now()
+        max_attempts = getattr(settings, 'NOTIFICATION_RETRY_MAX_ATTEMPTS', 5)
+        delivered_ids = []
+        failed = []
+
+        for notification in batch:
+            if push_results.get(notification.id) or email_results.get(notification.id):
+                delivered_ids.append(notification.id)
+                continue
+
+            notification.attempts += 1
+            notification.claimed_at = None
+            notification.claimed_by = ''
+            error = errors.get(notification.id)
+
+            if error is None:
+                # No email address and no active devices, so retrying will not help
+                notification.status = 'dead'
+                notification.last_error = 'No delivery channel available'
+            elif notification.attempts >= max_attempts:
+                notification.status = 'dead'
+                notification.last_error = error
+            else:
+                notification.next_attempt_at = now + NotificationService.get_retry_delay(notification.attempts)
+                notification.last_error = error
+
+            print(f"Notification {notification.id} failed ({notification.status}): {notification.last_error}")
+            failed.append(notification)
+
+        if delivered_ids:
+            Notification.objects.filter(id__in=delivered_ids).update(
+                status='sent',
+                sent=True,
+                sent_at=now,
+                attempts=F('attempts') + 1,
+                last_error='',
+                claimed_at=None,
+                claimed_by=''
+            )
+
+        if failed:
+            Notification.objects.bulk_update(
+                failed,
+                ['status', 'attempts', 'next_attempt_at', 'last_error', 'claimed_at', 'claimed_by']
+            )
+            timing_wheel.schedule_on_commit([n for n in failed if n.status == 'pending'])
+
+    @staticmethod
+    def get_retry_delay(attempts):
+        """Exponential backoff with jitter for the given number of failed attempts"""
+        base_delay = getattr(settings, 'NOTIFICATION_RETRY_BASE_DELAY', 60)
+        max_delay = getattr(settings, 'NOTIFICATION_RETRY_MAX_DELAY', 3600)
+        delay = min(max_delay, base_delay * 2 ** (attempts - 1))
+
+        # Keep at least half the delay and spread the rest, so notifications
+        # that failed together during an outage don't all retry at once
+        return timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+    @staticmethod
+    def prepare_push_targets(notifications, token_cache=None):
+        """Build a (notification, device, message) target for every active web device"""
+        push_notifications = [
+            notification for notification in notifications
+            if NotificationService.wants_push(notification)
+        ]
+        if not push_notifications:
+            return []
+
+        devices_by_user = NotificationService.get_active_web_devices(
+            {notification.user_id for notification in push_notifications},
+            token_cache
+        )
+
+        # One message per (group, device). Every notification of a digest gets
+        # a target sharing the digest message, so the targets of one message
+        # are adjacent and the rest of the pipeline stays per notification.
+        targets = []
+        for group in digest.group(push_notifications):
+            for device in devices_by_user.get(group[0].user_id, []):
+                if len(group) > 1:
+                    message = NotificationService.build_digest_web_message(device.token, group)
+                else:
+                    notification = group[0]
+                    message = NotificationService.build_web_message(
+                        device.token,
+                        notification.title,
+                        notification.message,
+                        notification.reminder_id,
+                        notification.subtask_id,
+                        "subtask" if notification.subtask_id else "reminder",
+                        tag=f"notification-{notification.id}"
+                    )
+                targets.extend((notification, device, message) for notification in group)
+
+        return targets
+
+    @staticmethod
+    def get_active_web_devices(user_ids, token_cache=None):
+        """
+        Return active web device tokens keyed by user id.
+
+        Users missing from token_cache are loaded with a single query and
+        added to it, so a dispatch run looks up each user's tokens only once.
+        """
+        token_cache = {} if token_cache is None else token_cache
+        missing_user_ids = set(user_ids) - token_cache.keys()
+
+        if missing_user_ids:
+            for user_id in missing_user_ids:
+                token_cache[user_id] = []
+            for device in DeviceToken.objects.filter(user_id__in=missing_user_ids, is_active=True, device_type='web'):
+                token_cache[device.user_id].append(device)
+
+        return {user_id: token_cache[user_id] for user_id in user_ids}
+
+    @staticmethod
+    def record_push_results(results, errors=None, invalid_device_ids=None):
+        """
+        Map per-message FCM results back to notifications and device tokens.
+
+        Devices whose token FCM rejected as unregistered or invalid are added
+        to invalid_device_ids instead of counting as a retryable error.
+        """
+        errors = {} if errors is None else errors
+        invalid_device_ids = set() if invalid_device_ids is None else invalid_device_ids
+        push_results = {}
+        delivered_device_ids = set()
+        for notification, device, success, error in results:
+            push_results[notification.id] = push_results.get(notification.id, False) or success
+            if success:
+                delivered_device_ids.add(device.id)
+            elif NotificationService.is_invalid_token_error(error):
+                invalid_device_ids.add(device.id)
+            else:
+                print(f'Error sending message to device {device.id}: {error}')
+                errors.setdefault(notification.id, f"push: {error}")
+
+        if delivered_device_ids:
+            DeviceToken.objects.filter(id__in=delivered_device_ids).update(last_used=timezone.now())
+
+        return push_results
+
+    @staticmethod
+    def is_invalid_token_error(error):
+        """Whether an FCM error means the device token will never work again"""
+        if isinstance(error, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+            return True
+
+        # INVALID_ARGUMENT is also used for malformed payloads, so only treat
+        # it as a dead token when FCM blames the registration token
+        return (
+            isinstance(error, firebase_exceptions.InvalidArgumentError)
+            and 'registration token' in str(error).lower()
+        )
+
+    @staticmethod
+    def prune_device_tokens(device_ids, token_cache=None):
+        """Deactivate invalid device tokens in one update and drop them from the token cache"""
+        if not device_ids:
+            return 0
+
+        pruned = DeviceToken.objects.filter(id__in=device_ids, is_active=True).update(is_active=False)
+
+        if token_cache:
+            for user_id, devices in token_cache.items():
+                token_cache[user_id] = [device for device in devices if device.id not in device_ids]
+
+        return pruned
+
+    @staticmethod
+    def send_messages(targets):
+        """
+        Send prepared FCM messages in chunks using the multi-send API.
+
+        targets is a list of (notification, device, message) tuples; the result
+        is a list of (notification, device, success, error) tuples in the same order.
+        """
+        results = []
+
+        for chunk in NotificationService.chunk_targets(targets):
+            # Adjacent targets of a digest share one message, which is sent once
+            messages = []
+            positions = []
+            for _, _, message in chunk:
+                if not messages or message is not messages[-1]:
+                    messages.append(message)
+                positions.append(len(messages) - 1)
+
+            try:
+                batch_response = messaging.send_each(messages)
+                responses = [(response.success, response.exception) for response in batch_response.responses]
+            except Exception as e:
+                # The whole request failed, so every message in the chunk failed
+                responses = [(False, e)] * len(messages)
+
+            for (notification, device, _), position in zip(chunk, positions):
+                success, error = responses[position]
+                results.append((notification, device, success, error))
+
+        return results
+
+    @staticmethod
+    def chunk_targets(targets):
+        """
+        Split targets into chunks of at most FCM_BATCH_SIZE distinct messages.
+
+        Adjacent targets sharing a digest message always land in the same chunk.
+        """
+        chunks = []
+        chunk = []
+        message_count = 0
+        previous_message = None
+        for target in targets:
+            message = target[2]
+            if message is not previous_message:
+                if message_count == FCM_BATCH_SIZE:
+                    chunks.append(chunk)
+                    chunk = []
+                    message_count = 0
+                message_count += 1
+                previous_message = message
+            chunk.append(target)
+
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    @staticmethod
+    def build_web_message(token, title, message, reminder_id, subtask_id=None, item_type='None', tag=None):
+        """
+        Build the FCM web push message for a reminder or subtask.
+
+        Browsers replace a shown notification that has the same tag, so a push
+        resent after a dispatcher crash does not show up twice.
+        """
+        notification = messaging.Notification(
+            title=title,
+            body=message,
+        )
         
-        # Get all unsent notifications that are due
-        due_notifications = Notification.objects.filter(
-            sent=False,
-            scheduled_time__lte=now
-        ).select_related('user', 'reminder', 'subtask')
+        data = {
+            'reminder_id': str(reminder_id),
+            'item_type': item_type
+        }
         
-        for notification in due_notifications:
-            reminder = notification.reminder
-            user = notification.user
-            subtask = notification.subtask
-            notification_preference = reminder.notification_preference
-            sent_successfully = False
+        # Add subtask_id if provided
+        if subtask_id:
+            data['subtask_id'] = str(subtask_id)
+            data['click_action'] = f'/reminders/{reminder_id}/subtasks/{subtask_id}/'
+        else:
+            data['click_action'] = f'/reminders/{reminder_id}/'
             
-            item = subtask if subtask else reminder
-            item_id = subtask.id if subtask else reminder.id 
-            item_type = "subtask" if subtask else "reminder"
-
-            # Handle email notifications
-            if notification_preference in ['email', 'both']:
-                email_sent = NotificationService.send_email_notification(
-                    user.email,
-                    notification.title,
-                    notification.message,
-                    item,
-                    item_type
+        return messaging.Message(
+            notification=notification,
+            data=data,
+            token=token,
+            webpush=messaging.WebpushConfig(
+                headers={
+                    'TTL': '86400'  
+                },
+                notification=messaging.WebpushNotification(
+                    icon='/static/reminders/images/notification-icon.png',
+                    tag=tag
                 )
-                if email_sent:
-                    sent_successfully = True
-            
-            # Handle push notifications
-            if notification_preference in ['push', 'both']:
-                # Get active device tokens for this user
-                device_tokens = DeviceToken.objects.filter(
-                    user=user,
-                    is_active=True
+            )
+        )
+
+    @staticmethod
+    def build_digest_web_message(token, notifications):
+        """Build one FCM web push message summarising a digest of notifications"""
+        title, body = digest.summarize(notifications)
+        return messaging.Message(
+            notification=messaging.Notification(
+                title=title,
+                body=body,
+            ),
+            data={
+                'item_type': 'digest',
+                'notification_ids': ','.join(str(notification.id) for notification in notifications),
+                'click_action': '/reminders/',
+            },
+            token=token,
+            webpush=messaging.WebpushConfig(
+                headers={
+                    'TTL': '86400'
+                },
+                notification=messaging.WebpushNotification(
+                    icon='/static/reminders/images/notification-icon.png',
+                    tag=f"digest-{notifications[0].id}"
                 )
-                
-                # Send to each device
-                for device in device_tokens:
-                    if device.device_type == 'web':
-                        sent = NotificationService.send_web_notification(
-                            device.token,
-                            notification.title,
-                            notification.message,
-                            reminder.id,
-                            subtask.id if subtask else None,
-                            item_type
-                        )
-                    else:
-                        sent = False
-                    
-                    if sent:
-                        sent_successfully = True
-            
-            # Mark notification as sent if either email or push notification was sent successfully
-            if sent_successfully:
-                notification.sent = True
-                notification.sent_at = now
-                notification.save()
-            
-            # If no devices and no email (or delivery failed), mark as sent anyway to avoid repeated attempts
-            if not sent_successfully:
-                notification.sent = True
-                notification.sent_at = now
-                notification.save()
+            )
+        )
 
     @staticmethod
     def send_web_notification(token, title, message, reminder_id, subtask_id=None, item_type='None'):
         """Send web push notification using Firebase Admin SDK"""
         try:
-            # Create message payload
-            notification = messaging.Notification(
-                title=title,
-                body=message,
-            )
-            
-            data = {
-                'reminder_id': str(reminder_id),
-                'item_type': item_type
-            }
-            
-            # Add subtask_id if provided
-            if subtask_id:
-                data['subtask_id'] = str(subtask_id)
-                data['click_action'] = f'/reminders/{reminder_id}/subtasks/{subtask_id}/'
-            else:
-                data['click_action'] = f'/reminders/{reminder_id}/'
-                
-            # Create and send message
-            message = messaging.Message(
-                notification=notification,
-                data=data,
-                token=token,
-                webpush=messaging.WebpushConfig(
-                    headers={
-                        'TTL': '86400'  
-                    },
-                    notification=messaging.WebpushNotification(
-                        icon='/static/reminders/images/notification-icon.png'
-                    )
-                )
+            message = NotificationService.build_web_message(
+                token, title, message, reminder_id, subtask_id, item_type
             )
             
             # Send the message
@@ -362,65 +1071,36 @@ class NotificationService:
         try:
             if not email:
                 return False
-           
-            subject = f"Reminder: {title}"
-            
-            date_str = item.date.strftime('%A, %B %d, %Y') if item.date else None
-            time_str = item.time.strftime('%I:%M %p') if hasattr(item, 'time') and item.time else None
-            
-            html_message = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <style>
-                    body {{ font-family: Arial, sans-serif; }}
-                    .container {{ padding: 20px; }}
-                    .reminder {{ background-color: #f8f9fa; padding: 15px; border-radius: 5px; }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <h1>{title}</h1>
-                    
-                    <div class="reminder">
-                        <p><strong>Type:</strong> {item_type.capitalize()}</p>
-                        <p>{message}</p>
-                        
-                        {f'<p><strong>Date:</strong> {date_str}</p>' if date_str else ''}
-                        {f'<p><strong>Time:</strong> {time_str}</p>' if time_str else ''}
-                    </div>
-                    
-                    <p style="margin-top: 20px;">
-                        This is a reminder from Reminder App.
-                    </p>
-                </div>
-            </body>
-            </html>
-            """
-            
-            plain_message = f"""
-            {title}
-
-            Type: {item_type.capitalize()}
-            
-            {message}
             
-            When: {date_str or 'No date'} {time_str or ''}
-            
-            Open the app to view more details.
-            """
-    
-            send_mail(
-                subject=subject,
-                message=plain_message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[email],
-                html_message=html_message,
-                fail_silently=False
-            )
+            NotificationService.build_email_message(email, title, message, item, item_type).send()
             
             print(f"Email notification sent to {email}: {title}")
             return True
         except Exception as e:
             print(f"Failed to send email notification: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    @staticmethod
+    def build_email_message(email, title, message, item, item_type):
+        """Build the notification email for a reminder or subtask"""
+        context = email_templates.build_context(title, message, item, item_type)
+        return NotificationService.create_email_message(email, email_templates.render_email(context))
+
+    @staticmethod
+    def create_email_message(email, rendered, message_id=None):
+        """
+        Wrap a rendered (subject, plain_message, html_message) email in a message.
+
+        A stable message_id lets mail clients drop a copy that is sent again
+        after a dispatcher crash.
+        """
+        subject, plain_message, html_message = rendered
+        email_message = EmailMultiAlternatives(
+            subject=subject,
+            body=plain_message,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[email],
+            headers={'Message-ID': message_id} if message_id else None
+        )
+        email_message.attach_alternative(html_message, "text/html")
+        return email_message
@@ -0,0 +1,106 @@
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from .models import DeliveryAttempt
+
+
+def push_key(notification_id, device_id):
+    return f"notification-{notification_id}-push-{device_id}"
+
+
+def email_key(notification_id):
+    return f"notification-{notification_id}-email"
+
+
+def reserve(targets, email_notifications):
+    """
+    Record every send of a claimed batch in the outbox before it happens.
+
+    Sends that an earlier run already acknowledged (e.g. the worker crashed
+    before marking the notification as sent) are dropped from targets and
+    email_notifications and reported in delivered, a dict mapping channel to
+    the notification ids they delivered. Everything else is stored as in-flight.
+    """
+    attempts = {}
+    for notification, device, _ in targets:
+        key = push_key(notification.id, device.id)
+        attempts[key] = DeliveryAttempt(notification=notification, channel='push', device=device, idempotency_key=key)
+    for notification in email_notifications:
+        key = email_key(notification.id)
+        attempts[key] = DeliveryAttempt(notification=notification, channel='email', idempotency_key=key)
+
+    delivered = {'push': set(), 'email': set()}
+    if not attempts:
+        return targets, email_notifications, delivered
+
+    existing = dict(
+        DeliveryAttempt.objects.filter(idempotency_key__in=attempts.keys())
+        .values_list('idempotency_key', 'status')
+    )
+    sent_keys = {key for key, status in existing.items() if status == 'sent'}
+    retry_keys = existing.keys() - sent_keys
+
+    if retry_keys:
+        DeliveryAttempt.objects.filter(idempotency_key__in=retry_keys).update(
+            status='sending',
+            attempts=F('attempts') + 1,
+            updated_at=timezone.now()
+        )
+
+    # Unique keys make a concurrent reservation of the same send a no-op
+    DeliveryAttempt.objects.bulk_create(
+        [attempt for key, attempt in attempts.items() if key not in existing],
+        ignore_conflicts=True
+    )
+
+    for key in sent_keys:
+        attempt = attempts[key]
+        delivered[attempt.channel].add(attempt.notification.id)
+
+    targets = [
+        target for target in targets
+        if push_key(target[0].id, target[1].id) not in sent_keys
+    ]
+    email_notifications = [
+        notification for notification in email_notifications
+        if email_key(notification.id) not in sent_keys
+    ]
+    return targets, email_notifications, delivered
+
+
+def acknowledge(push_results, email_results, errors):
+    """
+    Mark reserved sends as sent or failed once the providers have answered.
+
+    push_results are the (notification, device, success, error) tuples from
+    NotificationService.send_messages and email_results maps notification id
+    to whether its email was sent. Each outcome is written in one update.
+    """
+    now = timezone.now()
+    sent_keys = []
+    failed = {}
+    for notification, device, success, error in push_results:
+        key = push_key(notification.id, device.id)
+        if success:
+            sent_keys.append(key)
+        else:
+            failed[key] = str(error)
+    for notification_id, sent in email_results.items():
+        key = email_key(notification_id)
+        if sent:
+            sent_keys.append(key)
+        else:
+            failed[key] = errors.get(notification_id, '')
+
+    if sent_keys:
+        DeliveryAttempt.objects.filter(idempotency_key__in=sent_keys).update(
+            status='sent',
+            last_error='',
+            updated_at=now
+        )
+
+    if failed:
+        DeliveryAttempt.objects.filter(idempotency_key__in=failed.keys()).update(
+            status='failed',
+            last_error=Case(*[When(idempotency_key=key, then=Value(error)) for key, error in failed.items()]),
+            updated_at=now
+        )
@@ -0,0 +1,215 @@
+import calendar
+import re
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from . import archive
+from .models import DeliveryAttempt, Notification
+
+TABLE = Notification._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+UNPARTITIONED_TABLE = f'{TABLE}_unpartitioned'
+# Range partitions are named after the (UTC) day they start, e.g. reminders_notification_p20261001
+PARTITION_NAME = re.compile(rf'^{TABLE}_p(\d{{8}})$')
+
+
+def is_enabled():
+    return getattr(settings, 'NOTIFICATION_PARTITIONING_ENABLED', False) and connection.vendor == 'postgresql'
+
+
+def get_interval():
+    """'month' or 'week'"""
+    return getattr(settings, 'NOTIFICATION_PARTITION_INTERVAL', 'month')
+
+
+def get_bounds(day, interval=None):
+    """Start and end (exclusive) dates of the partition containing day"""
+    if (interval or get_interval()) == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+
+    start = day.replace(day=1)
+    return start, start + timedelta(days=calendar.monthrange(start.year, start.month)[1])
+
+
+def as_timestamp(day):
+    """SQL literal for UTC midnight of day"""
+    return f"'{datetime.combine(day, time.min, tzinfo=dt_timezone.utc).isoformat()}'"
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [TABLE])
+        return cursor.fetchone() is not None
+
+
+def list_partitions():
+    """Range partitions as {start date: name}; the default partition isn't included"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[datetime.strptime(match.group(1), '%Y%m%d').date()] = name
+    return partitions
+
+
+def create_partition(start, end):
+    """
+    Create the range partition for [start, end).
+
+    Rows that landed in the default partition because their range didn't
+    exist yet are moved into the new partition.
+    """
+    name = f'{TABLE}_p{start:%Y%m%d}'
+    in_range = f"scheduled_time >= {as_timestamp(start)} AND scheduled_time < {as_timestamp(end)}"
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE {in_range})')
+        if not cursor.fetchone()[0]:
+            cursor.execute(
+                f'CREATE TABLE "{name}" PARTITION OF "{TABLE}" '
+                f'FOR VALUES FROM ({as_timestamp(start)}) TO ({as_timestamp(end)})'
+            )
+            return name
+
+        cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{DEFAULT_PARTITION}"')
+        cursor.execute(
+            f'CREATE TABLE "{name}" PARTITION OF "{TABLE}" '
+            f'FOR VALUES FROM ({as_timestamp(start)}) TO ({as_timestamp(end)})'
+        )
+        cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{DEFAULT_PARTITION}" WHERE {in_range}')
+        cursor.execute(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE {in_range}')
+        cursor.execute(f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{DEFAULT_PARTITION}" DEFAULT')
+    return name
+
+
+def ensure_partitions(ahead=None, since=None, now=None):
+    """
+    Create the partitions from the current one through `ahead` intervals ahead.
+
+    ahead defaults to NOTIFICATION_PARTITIONS_AHEAD; since (a date) starts
+    the range earlier. Returns the names of the partitions created.
+    """
+    ahead = getattr(settings, 'NOTIFICATION_PARTITIONS_AHEAD', 3) if ahead is None else ahead
+    today = (now or timezone.now()).astimezone(dt_timezone.utc).date()
+    existing = list_partitions()
+
+    start = get_bounds(min(since or today, today))[0]
+    end = get_bounds(today)[1]
+    for _ in range(ahead):
+        end = get_bounds(end)[1]
+
+    created = []
+    while start < end:
+        next_start = get_bounds(start)[1]
+        if start not in existing:
+            created.append(create_partition(start, next_start))
+        start = next_start
+    return created
+
+
+def drop_expired_partitions(cutoff, detach=None, archive_rows=None):
+    """
+    Remove the partitions whose whole range ends before cutoff.
+
+    Dropping a partition replaces deleting its rows one by one; with detach
+    (NOTIFICATION_PARTITION_DETACH by default) the partitions are only
+    detached and kept as standalone tables. Unlike the row-based cleanup
+    this removes every notification in the range, sent or not, so with
+    archive_rows (NOTIFICATION_ARCHIVE_ENABLED by default) all of them and
+    their delivery attempts are archived before partitions are dropped.
+    Returns the names of the partitions removed.
+    """
+    detach = getattr(settings, 'NOTIFICATION_PARTITION_DETACH', False) if detach is None else detach
+    archive_rows = archive.is_enabled() if archive_rows is None else archive_rows
+    cutoff_day = cutoff.astimezone(dt_timezone.utc).date()
+    expired = [
+        (start, name) for start, name in sorted(list_partitions().items())
+        if get_bounds(start)[1] <= cutoff_day
+    ]
+
+    if expired and archive_rows and not detach:
+        in_expired = Q()
+        for start, _ in expired:
+            end = get_bounds(start)[1]
+            in_expired |= Q(
+                scheduled_time__gte=datetime.combine(start, time.min, tzinfo=dt_timezone.utc),
+                scheduled_time__lt=datetime.combine(end, time.min, tzinfo=dt_timezone.utc)
+            )
+        archive.archive_notifications(cutoff, notifications=Notification.objects.filter(in_expired), delete=False)
+
+    removed = []
+    for start, name in expired:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+            if not detach:
+                # Delivery attempts can't have a foreign key into a partitioned table
+                cursor.execute(
+                    f'DELETE FROM "{DeliveryAttempt._meta.db_table}" '
+                    f'WHERE notification_id IN (SELECT id FROM "{name}")'
+                )
+                cursor.execute(f'DROP TABLE "{name}"')
+        removed.append(name)
+
+    return removed
+
+
+def convert_table(ahead=None, now=None):
+    """
+    Turn the Notification table into one range-partitioned by scheduled_time.
+
+    The table is rebuilt in one transaction: the primary key becomes
+    (id, scheduled_time) as PostgreSQL requires, indexes and outgoing
+    foreign keys are recreated on the partitioned table, partitions are
+    created from the oldest notification through `ahead` intervals ahead
+    (later rows go to a default partition) and the rows are copied over.
+    The foreign key from DeliveryAttempt is dropped, since it can't
+    reference id alone any more. The table is locked while rows are copied.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p')",
+            [TABLE, TABLE]
+        )
+        index_definitions = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+            [TABLE]
+        )
+        foreign_keys = cursor.fetchall()
+
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{UNPARTITIONED_TABLE}"')
+        cursor.execute(
+            f'CREATE TABLE "{TABLE}" (LIKE "{UNPARTITIONED_TABLE}" '
+            f'INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS) PARTITION BY RANGE (scheduled_time)'
+        )
+        cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{TABLE}" DEFAULT')
+
+        cursor.execute(f'SELECT MIN(scheduled_time) FROM "{UNPARTITIONED_TABLE}"')
+        oldest = cursor.fetchone()[0]
+        ensure_partitions(ahead, since=oldest.astimezone(dt_timezone.utc).date() if oldest else None, now=now)
+
+        cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{UNPARTITIONED_TABLE}"')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('\"{TABLE}\"', 'id'), "
+            f'COALESCE((SELECT MAX(id) FROM "{TABLE}"), 0) + 1, false)'
+        )
+        cursor.execute(f'DROP TABLE "{UNPARTITIONED_TABLE}" CASCADE')
+
+        # The index and constraint names are free again now
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY (id, scheduled_time)')
+        for definition in index_definitions:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition}')
@@ -0,0 +1,229 @@
+import calendar
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from math import gcd
+from django.utils import timezone
+
+# Repeat choices that advance by a fixed number of days or months
+DAY_STEPS = {
+    'daily': 1,
+    'weekly': 7,
+    'biweekly': 14,
+}
+MONTH_STEPS = {
+    'monthly': 1,
+    'quarterly': 3,
+    'biannually': 6,
+    'yearly': 12,
+}
+WEEKDAY_SETS = {
+    'weekdays': (0, 1, 2, 3, 4),
+    'weekends': (5, 6),
+}
+
+
+class Recurrence(ABC):
+    """
+    A reminder's repeat rule compiled to closed-form arithmetic.
+
+    Occurrences are numbered from 1, the first repeat after the start date.
+    nth() and count_through() are computed directly instead of stepping
+    through every earlier occurrence, so finding the next occurrence costs
+    the same whatever the horizon.
+    """
+
+    def __init__(self, start):
+        self.start = start
+
+    @abstractmethod
+    def nth(self, n):
+        """The nth occurrence after the start"""
+
+    @abstractmethod
+    def count_through(self, day):
+        """Number of occurrences on or before day"""
+
+    def next_after(self, day):
+        """The first occurrence after day"""
+        return self.nth(self.count_through(day) + 1)
+
+    def through(self, day):
+        """All occurrences on or before day, in order"""
+        return [self.nth(n) for n in range(1, self.count_through(day) + 1)]
+
+
+class DailyRecurrence(Recurrence):
+    """Every `days` days"""
+
+    def __init__(self, start, days):
+        super().__init__(start)
+        self.days = days
+
+    def nth(self, n):
+        return self.start + timedelta(days=n * self.days)
+
+    def count_through(self, day):
+        return max(0, (day - self.start).days // self.days)
+
+
+class WeekdayRecurrence(Recurrence):
+    """Every day whose weekday (Monday is 0) is in weekdays"""
+
+    def __init__(self, start, weekdays):
+        super().__init__(start)
+        self.weekdays = sorted(weekdays)
+        self.start_rank = self.rank(start)
+
+    def rank(self, day):
+        # Ordinal 1 (0001-01-01) is a Monday, so weeks line up with ordinals
+        weeks, weekday = divmod(day.toordinal() - 1, 7)
+        return weeks * len(self.weekdays) + bisect_right(self.weekdays, weekday)
+
+    def nth(self, n):
+        weeks, index = divmod(self.start_rank + n - 1, len(self.weekdays))
+        return date.fromordinal(weeks * 7 + self.weekdays[index] + 1)
+
+    def count_through(self, day):
+        return max(0, self.rank(day) - self.start_rank)
+
+
+class MonthlyRecurrence(Recurrence):
+    """
+    Every `months` months on the start date's day of the month.
+
+    A day that doesn't exist in a month is clamped to the month's last day,
+    and the clamped day carries over to later occurrences (Jan 31, Feb 28,
+    Mar 28, ...), as when stepping one month at a time.
+    """
+
+    def __init__(self, start, months):
+        super().__init__(start)
+        self.months = months
+        self.start_month = start.year * 12 + start.month - 1
+        self.clamps = self.find_clamps()
+
+    def find_clamps(self):
+        """
+        Occurrence numbers where the clamped day drops, and the day it drops to.
+
+        Computed once per rule: no month is shorter than 28 days, so the walk
+        stops there, or once every month the rule visits has been seen.
+        """
+        day = self.start.day
+        indexes, days = [], []
+        if day <= 28:
+            return indexes, days
+
+        # Month-of-year pattern repeats every cycle occurrences; a century
+        # of cycles always reaches a non-leap February when one is visited
+        cycle = 12 // gcd(self.months, 12)
+        for n in range(1, cycle * 101 + 1):
+            year, month = divmod(self.start_month + n * self.months, 12)
+            length = calendar.monthrange(year, month + 1)[1]
+            if length < day:
+                day = length
+                indexes.append(n)
+                days.append(day)
+                if day == 28:
+                    break
+        return indexes, days
+
+    def nth(self, n):
+        year, month = divmod(self.start_month + n * self.months, 12)
+        indexes, days = self.clamps
+        position = bisect_right(indexes, n)
+        day = days[position - 1] if position else self.start.day
+        return self.start.replace(year=year, month=month + 1, day=day)
+
+    def count_through(self, day):
+        n = (day.year * 12 + day.month - 1 - self.start_month) // self.months
+        if n >= 1 and self.nth(n) > day:
+            n -= 1
+        return max(0, n)
+
+
+class HourlyRecurrence(Recurrence):
+    """
+    Every hour after the reminder time, up to per_day times a day.
+
+    Occurrences are timezone-aware datetimes; each day from the start date
+    gets the same hours after the reminder's time of day.
+    """
+
+    def __init__(self, start, time, per_day):
+        super().__init__(start)
+        self.time = time
+        self.per_day = per_day
+
+    def nth(self, n):
+        days, hour = divmod(n - 1, self.per_day)
+        day_start = timezone.make_aware(datetime.combine(self.start + timedelta(days=days), self.time))
+        return day_start + timedelta(hours=hour + 1)
+
+    def count_through(self, day):
+        return max(0, ((day - self.start).days + 1) * self.per_day)
+
+    def next_after(self, instant):
+        """The first occurrence after a date or an aware datetime"""
+        if not isinstance(instant, datetime):
+            return self.nth(self.count_through(instant) + 1)
+
+        local_day = timezone.localtime(instant).date()
+        if local_day < self.start:
+            return self.nth(1)
+
+        # Whole hours past the reminder time on that day
+        day_start = timezone.make_aware(datetime.combine(local_day, self.time))
+        hours = max(0, (instant - day_start) // timedelta(hours=1))
+        return self.nth((local_day - self.start).days * self.per_day + min(hours, self.per_day) + 1)
+
+
+def compile_rule(reminder, future_days=90):
+    """
+    Compile a reminder's repeat settings into a Recurrence.
+
+    Returns None when the reminder doesn't repeat or its settings can't
+    produce any occurrence. future_days caps the hourly repeats per day, as
+    NotificationService.schedule_recurring_reminders always has.
+    """
+    if reminder.repeat == 'never' or not reminder.date:
+        return None
+
+    start = reminder.date
+    repeat = reminder.repeat
+
+    if repeat in DAY_STEPS:
+        return DailyRecurrence(start, DAY_STEPS[repeat])
+    if repeat in MONTH_STEPS:
+        return MonthlyRecurrence(start, MONTH_STEPS[repeat])
+    if repeat in WEEKDAY_SETS:
+        return WeekdayRecurrence(start, WEEKDAY_SETS[repeat])
+
+    if repeat == 'hourly':
+        if not reminder.time:
+            return None
+        per_day = min(min(24, future_days) - 1, 23 - reminder.time.hour)
+        return HourlyRecurrence(start, reminder.time, per_day) if per_day > 0 else None
+
+    if repeat == 'custom' and reminder.custom_repeat_interval:
+        interval = reminder.custom_repeat_interval
+        try:
+            if 'days' in interval:
+                days, months = int(interval['days']), 0
+            elif 'weeks' in interval:
+                days, months = int(interval['weeks']) * 7, 0
+            elif 'months' in interval:
+                days, months = 0, int(interval['months'])
+            else:
+                # Default to daily if custom pattern is invalid
+                days, months = 1, 0
+        except (TypeError, ValueError):
+            return None
+
+        if months > 0:
+            return MonthlyRecurrence(start, months)
+        if days > 0:
+            return DailyRecurrence(start, days)
+
+    return None
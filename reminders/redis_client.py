@@ -0,0 +1,12 @@
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_client():
+    """Return the process-wide Redis client used by the timing wheel and rate limiter"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(getattr(settings, 'REDIS_URL', 'redis://localhost:6379/0'))
+    return _client
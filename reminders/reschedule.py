@@ -0,0 +1,57 @@
+import redis
+from django.conf import settings
+from django.db import transaction
+from .redis_client import get_client
+
+KEY_PREFIX = 'reminders:reschedule:'
+
+
+def is_enabled():
+    return getattr(settings, 'NOTIFICATION_ASYNC_SCHEDULING', False)
+
+
+def get_key(kind, pk):
+    return f"{KEY_PREFIX}{kind}:{pk}"
+
+
+def enqueue_on_commit(kind, pk):
+    """
+    Queue a "reschedule this reminder/subtask" job once the transaction commits.
+
+    kind is 'reminder' or 'subtask'. A Redis key marks the job as queued until
+    a worker picks it up, so any number of saves before then collapse into a
+    single job; the worker reads the latest state from the database.
+    """
+    def enqueue():
+        from .tasks import reschedule_notifications
+
+        try:
+            queued = get_client().set(
+                get_key(kind, pk), 1, nx=True,
+                ex=getattr(settings, 'NOTIFICATION_RESCHEDULE_DEDUPE_TTL', 300)
+            )
+        except redis.RedisError as e:
+            # Without the marker the job may run more than once, which is harmless
+            print(f"Reschedule deduplication unavailable for {kind} {pk}: {e}")
+            queued = True
+
+        if not queued:
+            return
+
+        try:
+            reschedule_notifications.delay(kind, pk)
+        except Exception as e:
+            # Don't lose the change if the broker is down: reschedule in-process
+            print(f"Failed to queue rescheduling of {kind} {pk}, running it now: {e}")
+            release(kind, pk)
+            reschedule_notifications(kind, pk)
+
+    transaction.on_commit(enqueue)
+
+
+def release(kind, pk):
+    """Clear the queued marker, so saves made from now on queue a new job"""
+    try:
+        get_client().delete(get_key(kind, pk))
+    except redis.RedisError as e:
+        print(f"Failed to clear reschedule marker for {kind} {pk}: {e}")
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from django.db.models import Exists, OuterRef, Prefetch, Subquery
 from django.contrib.auth.models import User
 from .models import Reminder, SubTask, Tag, DeviceToken, Notification, UserProfile, SharedReminder
 import pytz
@@ -203,28 +204,55 @@ class ReminderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'completed_at', 'image_url']
     
+    @staticmethod
+    def setup_eager_loading(queryset, user):
+        """
+        Load everything the serializer reads for a list of reminders up front.
+
+        Tags and subtasks (with their tags) are prefetched and the sharing
+        state is annotated, so serializing a page takes the same number of
+        queries however many reminders it has.
+        """
+        shares = SharedReminder.objects.filter(reminder=OuterRef('pk'))
+        return queryset.annotate(
+            has_shares=Exists(shares),
+            shared_with_me_permissions=Subquery(shares.filter(shared_with=user).values('permissions')[:1])
+        ).prefetch_related(
+            'tags',
+            Prefetch('subtasks', queryset=SubTask.objects.prefetch_related('tags'))
+        )
+
+    def has_shares(self, obj):
+        if hasattr(obj, 'has_shares'):
+            return obj.has_shares
+        return SharedReminder.objects.filter(reminder=obj).exists()
+
     def get_is_shared(self, obj):
         user = self.context['request'].user
         
-        if user == obj.user:
+        if user.pk == obj.user_id:
            
-            return SharedReminder.objects.filter(reminder=obj).exists()
+            return self.has_shares(obj)
         else:
             
             return True
     
     def get_sharing_status(self, obj):
         user = self.context['request'].user
-        if user == obj.user:
-            if SharedReminder.objects.filter(reminder=obj).exists():
+        if user.pk == obj.user_id:
+            if self.has_shares(obj):
                 return "shared_by_me"
             return "owned"
         else:
-            try:
-                shared = SharedReminder.objects.get(reminder=obj, shared_with=user)
-                return f"shared_with_me_{shared.permissions}"
-            except SharedReminder.DoesNotExist:
-                return "owned"
+            if hasattr(obj, 'shared_with_me_permissions'):
+                permissions = obj.shared_with_me_permissions
+            else:
+                permissions = SharedReminder.objects.filter(
+                    reminder=obj, shared_with=user
+                ).values_list('permissions', flat=True).first()
+            if permissions:
+                return f"shared_with_me_{permissions}"
+            return "owned"
             
     def get_local_scheduled_time(self, obj):
         user = self.context['request'].user
@@ -245,7 +273,8 @@ class ReminderSerializer(serializers.ModelSerializer):
         validated_data['user'] = user
         scheduled_time = validated_data.pop('scheduled_time')
 
-        reminder = Reminder.objects.create(**validated_data)
+        # Saved once, so notifications are only scheduled for the final date and time
+        reminder = Reminder(**validated_data)
         reminder.set_local_scheduled_time(user, scheduled_time)
         reminder.save()
         
@@ -343,8 +372,8 @@ class DeviceTokenSerializer(serializers.ModelSerializer):
 class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
-        fields = ['id', 'reminder', 'title', 'message', 'scheduled_time', 'sent', 'sent_at']
-        read_only_fields = ['id', 'sent', 'sent_at']
+        fields = ['id', 'reminder', 'title', 'message', 'scheduled_time', 'sent', 'sent_at', 'status', 'attempts']
+        read_only_fields = ['id', 'sent', 'sent_at', 'status', 'attempts']
 
 
 class SharedReminderSerializer(serializers.ModelSerializer):
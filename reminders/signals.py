@@ -2,18 +2,35 @@ from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from .models import Reminder, SubTask, UserProfile
 from .notification_service import NotificationService
+from . import reschedule, timezones
 from django.contrib.auth.models import User
 
 
+def get_saved_changes(instance, created, update_fields):
+    """Fields a save changed, or None when every field has to be treated as changed"""
+    changed = getattr(instance, 'changed_fields', None)
+    if created or changed is None:
+        return None
+    if update_fields is not None:
+        changed = changed & {instance._meta.get_field(name).attname for name in update_fields}
+    return changed
+
+
 @receiver(post_save, sender=Reminder)
-def reminder_saved(sender, instance, created, **kwargs):
+def reminder_saved(sender, instance, created, update_fields=None, **kwargs):
     """Signal handler for reminder saves to schedule notifications"""
-    # Schedule notifications for the reminder
-    NotificationService.schedule_notifications_for_reminder(instance)
-    
-    # If it's a recurring reminder, schedule future instances
-    if not created and instance.repeat != 'never':
-        NotificationService.schedule_recurring_reminders(instance)
+    changed = get_saved_changes(instance, created, update_fields)
+
+    if changed is None or changed & Reminder.SCHEDULE_FIELDS:
+        if reschedule.is_enabled():
+            # Let a Celery worker reschedule once the request's transaction commits
+            reschedule.enqueue_on_commit('reminder', instance.pk)
+        else:
+            # Schedule notifications for the reminder, including the upcoming
+            # instances of a recurring reminder
+            NotificationService.schedule_notifications_for_reminder(instance)
+    elif changed & Reminder.NOTIFICATION_PRIORITY_FIELDS:
+        NotificationService.update_notification_priority(instance)
 
 
 @receiver(post_delete, sender=Reminder)
@@ -24,10 +41,18 @@ def reminder_deleted(sender, instance, **kwargs):
     Notification.objects.filter(reminder=instance).delete()
 
 @receiver(post_save, sender=SubTask)
-def subtask_saved(sender, instance, created, **kwargs):
+def subtask_saved(sender, instance, created, update_fields=None, **kwargs):
     """Signal handler for subtask saves to schedule notifications"""
-    # Schedule notifications for the subtask
-    NotificationService.schedule_notifications_for_subtask(instance)
+    changed = get_saved_changes(instance, created, update_fields)
+
+    if changed is None or changed & SubTask.SCHEDULE_FIELDS:
+        if reschedule.is_enabled():
+            reschedule.enqueue_on_commit('subtask', instance.pk)
+        else:
+            # Schedule notifications for the subtask
+            NotificationService.schedule_notifications_for_subtask(instance)
+    elif changed & SubTask.NOTIFICATION_PRIORITY_FIELDS:
+        NotificationService.update_notification_priority(instance)
 
 @receiver(post_delete, sender=SubTask)
 def subtask_deleted(sender, instance, **kwargs):
@@ -36,6 +61,12 @@ def subtask_deleted(sender, instance, **kwargs):
     from .models import Notification
     Notification.objects.filter(subtask=instance).delete()
 
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def user_profile_changed(sender, instance, **kwargs):
+    """Drop the cached timezone when a user's profile changes"""
+    timezones.invalidate(instance)
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Create a UserProfile for each new User."""
@@ -1,89 +1,255 @@
 from celery import shared_task
+from django.conf import settings
 from django.db.models import Q
 from django.utils import timezone
-from .models import Reminder, Notification, SubTask
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.contrib.auth.models import User
+from .models import Reminder, Notification, OverdueSweep, SubTask, UserProfile
 from .notification_service import NotificationService
+from . import archive, partitions, reschedule, timezones, timing_wheel
 
 
 @shared_task
 def send_due_notifications():
     """Celery task to send notifications that are due"""
-    NotificationService.send_due_notifications()
+    workers = getattr(settings, 'NOTIFICATION_DISPATCH_WORKERS', 1)
+
+    # Urgent dispatchers run on their own queue, so high priority and flagged
+    # reminders are not stuck behind a backlog on the default queue
+    for _ in range(getattr(settings, 'NOTIFICATION_URGENT_DISPATCH_WORKERS', 0)):
+        dispatch_notification_batches.apply_async(
+            kwargs={'priorities': [Notification.PRIORITY_URGENT]},
+            queue=getattr(settings, 'NOTIFICATION_URGENT_QUEUE', 'notifications-urgent')
+        )
+    
+    if workers <= 1:
+        return NotificationService.send_due_notifications()
+    
+    # Fan out to several dispatchers; claims keep their batches disjoint
+    for _ in range(workers):
+        dispatch_notification_batches.delay()
+
+
+@shared_task(bind=True)
+def dispatch_notification_batches(self, max_batches=None, priorities=None):
+    """Celery task for a single dispatcher worker claiming batches of due notifications"""
+    worker_id = f"{NotificationService.get_worker_id()}:{self.request.id}"
+    return NotificationService.send_due_notifications(
+        worker_id=worker_id,
+        max_batches=max_batches,
+        priorities=priorities
+    )
+
+
+def get_reminders_to_refill(now):
+    """Recurring reminders whose materialized window ends within NOTIFICATION_RECURRENCE_REFILL_DAYS"""
+    refill_before = now + timedelta(days=getattr(settings, 'NOTIFICATION_RECURRENCE_REFILL_DAYS', 2))
+    return Reminder.objects.filter(
+        ~Q(repeat='never'),
+        Q(materialized_until__isnull=True) | Q(materialized_until__lt=refill_before),
+        Q(repeat_end_date__isnull=True) | Q(repeat_end_date__gte=now.date()),
+        is_completed=False,
+        date__isnull=False
+    )
+
+
+@shared_task(bind=True)
+def reschedule_recurring_reminders(self, days_ahead=None):
+    """
+    Celery task to extend the rolling notification window of recurring reminders.
+
+    Only reminders whose materialized window ends within
+    NOTIFICATION_RECURRENCE_REFILL_DAYS are visited; the others already
+    have their upcoming notifications. This task only streams their ids and
+    fans them out in chunks of NOTIFICATION_RECURRENCE_CHUNK_SIZE to
+    refill_recurring_chunk tasks, so the work spreads over all workers.
+    Chunks are idempotent (a refilled reminder no longer matches), so
+    running the task again after a failure resumes where it stopped.
+    """
+    now = timezone.now()
+    chunk_size = getattr(settings, 'NOTIFICATION_RECURRENCE_CHUNK_SIZE', 500)
+    reminder_ids = get_reminders_to_refill(now).order_by('pk').values_list('pk', flat=True)
+
+    chunk = []
+    progress = {'reminders': 0, 'chunks': 0}
+
+    def dispatch():
+        refill_recurring_chunk.delay(chunk, days_ahead, now.isoformat())
+        progress['reminders'] += len(chunk)
+        progress['chunks'] += 1
+        if not self.request.called_directly:
+            self.update_state(state='PROGRESS', meta=progress)
+
+    # iterator() streams the ids (a server-side cursor on PostgreSQL)
+    for reminder_id in reminder_ids.iterator(chunk_size=chunk_size):
+        chunk.append(reminder_id)
+        if len(chunk) == chunk_size:
+            dispatch()
+            chunk = []
+    if chunk:
+        dispatch()
+
+    print(f"Dispatched {progress['reminders']} recurring reminders in {progress['chunks']} chunks")
+    return progress
 
 
 @shared_task
-def reschedule_recurring_reminders(days_ahead=90):
-    """Celery task to schedule upcoming recurring reminders"""
-    reminders = Reminder.objects.filter(
-        ~Q(repeat='never'), 
-        is_completed=False
+def refill_recurring_chunk(reminder_ids, days_ahead=None, now=None):
+    """Celery task extending the rolling window of one chunk of recurring reminders"""
+    now = datetime.fromisoformat(now) if now else timezone.now()
+
+    # Filtered again, so a chunk retried or overtaken by a newer run skips
+    # reminders that were already refilled or changed meanwhile
+    reminders = list(
+        get_reminders_to_refill(now).filter(pk__in=reminder_ids).only(
+            'user_id', 'title', 'description', 'date', 'time', 'early_reminder',
+            'custom_early_reminder', 'repeat', 'repeat_end_date', 'custom_repeat_interval',
+            'is_completed', 'is_flagged', 'priority', 'materialized_until'
+        )
     )
-    
-    for reminder in reminders:
-        NotificationService.schedule_recurring_reminders(reminder, days_ahead)
+    notifications = NotificationService.materialize_recurring_batch(reminders, days_ahead, now)
+    return {'reminders': len(reminders), 'notifications': len(notifications)}
+
+@shared_task
+def reschedule_notifications(kind, pk):
+    """Celery task rescheduling a reminder's or subtask's notifications after it was saved"""
+    # Cleared before reading, so a save made while this runs queues another job
+    reschedule.release(kind, pk)
+
+    if kind == 'subtask':
+        subtask = SubTask.objects.select_related('reminder__user').filter(pk=pk).first()
+        if subtask:
+            NotificationService.schedule_notifications_for_subtask(subtask)
+        return
+
+    reminder = Reminder.objects.select_related('user').filter(pk=pk).first()
+    if reminder:
+        NotificationService.schedule_notifications_for_reminder(reminder)
 
 @shared_task
 def check_overdue_items():
     """Check for overdue reminders and subtasks and send notifications"""
-    today = timezone.now().date()
-    
-    overdue_reminders = Reminder.objects.filter(
-        date__lt=today,
-        is_completed=False
-    )
-    
-    for reminder in overdue_reminders:
-        if not Notification.objects.filter(
-            reminder=reminder,
-            subtask=None,  
-            title__startswith="Overdue",
-            sent_at__date=today  
-        ).exists():
-            # Calculate days overdue
-            days_overdue = (today - reminder.date).days
-            overdue_text = "yesterday" if days_overdue == 1 else f"{days_overdue} days ago"
-            
-            Notification.objects.create(
-                user=reminder.user,
-                reminder=reminder,
-                subtask=None,
-                title=f"Overdue: {reminder.title}",
-                message=f"This reminder was due {overdue_text}",
-                scheduled_time=timezone.now(),
-                sent=False
-            )
-    
-    overdue_subtasks = SubTask.objects.filter(
-        date__lt=today,
-        is_completed=False
+    now = timezone.now()
+    today = now.date()
+
+    created = NotificationService.create_overdue_notifications(
+        Reminder.objects.filter(date__lt=today, is_completed=False),
+        SubTask.objects.filter(date__lt=today, is_completed=False),
+        today,
+        now
     )
+    print(f"Created {created} overdue notifications")
+
+def due_before(instant):
+    """
+    Filter for reminders or subtasks due before an aware datetime.
+
+    Their date and time are stored in UTC, so the whole UTC instant is
+    compared; all-day items (no time) count from 00:00 UTC on their date.
+    """
+    instant = instant.astimezone(dt_timezone.utc)
+    due = Q(date__lt=instant.date()) | Q(date=instant.date(), time__lt=instant.time())
+    if instant.time() > time.min:
+        due |= Q(date=instant.date(), time__isnull=True)
+    return due
+
+@shared_task
+def check_overdue_items_by_timezone():
+    """
+    Hourly overdue sweep for the users whose local day rolled over.
+
+    Every timezone records the last local day it was swept for, and each run
+    processes the timezones whose local date has advanced since then, so a
+    late or skipped run (or a DST change skipping midnight) still sweeps the
+    day. A timezone that was never swept starts in the hour after its next
+    local midnight. "Overdue" follows each user's own calendar: an item is
+    overdue once it was due before the start of the user's local day. Users
+    without a profile count as UTC.
+    """
+    now = timezone.now()
+    names = set(UserProfile.objects.values_list('timezone', flat=True).distinct().order_by())
+    names.add('UTC')
+    last_swept = dict(OverdueSweep.objects.values_list('timezone', 'last_swept'))
+
+    # Timezones on the same local day (and offset) are swept together
+    timezones_by_day = {}
+    for name in names:
+        tz = timezones.get_timezone(name)
+        today = now.astimezone(tz).date()
+        # The first instant of the local day, which is later than 00:00
+        # when a DST change skips midnight
+        day_start = tz.normalize(tz.localize(datetime.combine(today, time.min)))
+        if name in last_swept:
+            if last_swept[name] >= today:
+                continue
+        elif now - day_start >= timedelta(hours=1):
+            continue
+        timezones_by_day.setdefault((today, day_start.utcoffset(), day_start.time()), []).append(name)
+
+    created = 0
+    for (today, offset, start), names in timezones_by_day.items():
+        users = Q(userprofile__timezone__in=names)
+        if 'UTC' in names:
+            users |= Q(userprofile__isnull=True)
+        user_ids = User.objects.filter(users).values('pk')
+        day_start = datetime.combine(today, start, tzinfo=dt_timezone(offset))
+
+        created += NotificationService.create_overdue_notifications(
+            Reminder.objects.filter(due_before(day_start), user__in=user_ids, is_completed=False),
+            SubTask.objects.filter(due_before(day_start), reminder__user__in=user_ids, is_completed=False),
+            today,
+            now,
+            # The start of the local day, so a rerun within the same local
+            # day doesn't notify again and days overdue are counted on the
+            # local calendar
+            day_start=day_start
+        )
+        OverdueSweep.objects.bulk_create(
+            [OverdueSweep(timezone=name, last_swept=today) for name in names],
+            update_conflicts=True,
+            unique_fields=['timezone'],
+            update_fields=['last_swept'],
+        )
+
+    print(f"Created {created} overdue notifications for {sum(len(names) for names in timezones_by_day.values())} timezones")
+    return created
+
+@shared_task
+def reconcile_timing_wheel():
+    """Celery task to repair drift between the Redis timing wheel and the Notification table"""
+    if not timing_wheel.is_enabled():
+        return
     
-    for subtask in overdue_subtasks:
-        if not Notification.objects.filter(
-            reminder=subtask.reminder,
-            subtask=subtask,
-            title__startswith="Overdue",
-            sent_at__date=today  
-        ).exists():
-            # Calculate days overdue
-            days_overdue = (today - subtask.date).days
-            overdue_text = "yesterday" if days_overdue == 1 else f"{days_overdue} days ago"
-            
-            Notification.objects.create(
-                user=subtask.reminder.user,
-                reminder=subtask.reminder,
-                subtask=subtask,
-                title=f"Overdue: {subtask.title}",
-                message=f"This subtask was due {overdue_text}",
-                scheduled_time=timezone.now(),
-                sent=False
-            )
+    added, removed = timing_wheel.TimingWheel().reconcile()
+    print(f"Timing wheel reconciled: {added} added, {removed} removed")
 
 @shared_task
 def clean_old_notifications(days=30):
     """Celery task to remove old sent notifications"""
     cutoff_date = timezone.now() - timezone.timedelta(days=days)
+
+    if partitions.is_enabled() and partitions.is_partitioned():
+        # Drop whole expired partitions instead of deleting rows (archiving
+        # every row in them first when archiving is enabled), and make sure
+        # the upcoming ones exist
+        created = partitions.ensure_partitions()
+        removed = partitions.drop_expired_partitions(cutoff_date)
+        print(f"Created partitions {created}, removed expired partitions {removed}")
+        return
+
+    if archive.is_enabled():
+        # Keep the delivery history in cold storage before it is removed
+        archive.archive_notifications(cutoff_date)
+
     Notification.objects.filter(
         sent=True,
         sent_at__lt=cutoff_date
     ).delete()
+
+
+@shared_task
+def archive_old_notifications(days=30):
+    """Celery task to move sent notifications older than `days` days to compressed archive files"""
+    manifest = archive.archive_notifications(timezone.now() - timedelta(days=days))
+    print(f"Archived old notifications: {manifest or 'nothing to archive'}")
+    return manifest
@@ -1,3 +1,1200 @@
-from django.test import TestCase
+import asyncio
+import calendar
+import json
+import random
+import tempfile
+import threading
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from django.utils import timezone
+from firebase_admin import exceptions as firebase_exceptions, messaging
+import fakeredis
+import redis
+from asgiref.sync import async_to_sync
+from .delivery_engine import DeliveryEngine
+from .models import DeliveryAttempt, DeviceToken, Notification, OverdueSweep, Reminder, SharedReminder, SubTask, Tag, UserProfile
+from .notification_service import FCM_BATCH_SIZE, NotificationService
+from . import archive, delivery_engine, email_templates, rate_limit, recurrence, redis_client, reschedule, tasks, timezones, timing_wheel
 
-# Create your tests here.
+
+class FakeMessaging:
+    """Stands in for the FCM send_each endpoint, answering each message with a scripted result"""
+
+    def __init__(self, errors=None):
+        # token -> exception returned for messages to that token
+        self.errors = errors or {}
+        self.calls = []
+
+    def send_each(self, messages, dry_run=False):
+        self.calls.append(messages)
+        responses = []
+        for index, message in enumerate(messages):
+            error = self.errors.get(message.token)
+            if error is None:
+                responses.append(messaging.SendResponse({'name': f'projects/test/messages/{index}'}, None))
+            else:
+                responses.append(messaging.SendResponse(None, error))
+        return messaging.BatchResponse(responses)
+
+
+def create_due_notifications(user, count, notification_preference='push'):
+    reminder = Reminder.objects.create(user=user, title='Reminder', notification_preference=notification_preference)
+    due = timezone.now() - timedelta(minutes=1)
+    return Notification.objects.bulk_create([
+        Notification(
+            user=user,
+            reminder=reminder,
+            title=f'Notification {index}',
+            message='Time for your reminder!',
+            scheduled_time=due,
+            next_attempt_at=due
+        )
+        for index in range(count)
+    ])
+
+
+class PushBatchingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+        self.phone = DeviceToken.objects.create(user=self.user, token='phone-token', device_type='web')
+        self.laptop = DeviceToken.objects.create(user=self.user, token='laptop-token', device_type='web')
+        DeviceToken.objects.filter(pk__in=[self.phone.pk, self.laptop.pk]).update(
+            last_used=timezone.now() - timedelta(days=1)
+        )
+
+    def send(self, fake):
+        with mock.patch.object(messaging, 'send_each', fake.send_each):
+            return NotificationService.send_due_notifications()
+
+    def test_success_marks_notification_sent_and_devices_used(self):
+        notification, = create_due_notifications(self.user, 1)
+        fake = FakeMessaging()
+
+        self.send(fake)
+
+        self.assertEqual([len(messages) for messages in fake.calls], [2])
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, 'sent')
+        self.assertTrue(notification.sent)
+        self.assertEqual(notification.attempts, 1)
+        for device in DeviceToken.objects.filter(user=self.user):
+            self.assertTrue(device.is_active)
+            self.assertGreater(device.last_used, timezone.now() - timedelta(minutes=1))
+
+    def test_one_delivered_device_is_enough(self):
+        notification, = create_due_notifications(self.user, 1)
+        fake = FakeMessaging({'laptop-token': firebase_exceptions.UnavailableError('Service unavailable')})
+
+        self.send(fake)
+
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, 'sent')
+        self.laptop.refresh_from_db()
+        self.assertTrue(self.laptop.is_active)
+        self.assertLess(self.laptop.last_used, timezone.now() - timedelta(hours=1))
+
+    def test_transient_error_schedules_a_retry(self):
+        notification, = create_due_notifications(self.user, 1)
+        error = firebase_exceptions.UnavailableError('Service unavailable')
+        fake = FakeMessaging({'phone-token': error, 'laptop-token': error})
+
+        self.send(fake)
+
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, 'pending')
+        self.assertFalse(notification.sent)
+        self.assertEqual(notification.attempts, 1)
+        self.assertIn('push: Service unavailable', notification.last_error)
+        self.assertGreater(notification.next_attempt_at, timezone.now())
+        self.assertEqual(notification.claimed_by, '')
+        self.assertEqual(DeviceToken.objects.filter(user=self.user, is_active=True).count(), 2)
+
+    def test_invalid_token_is_pruned(self):
+        notification, = create_due_notifications(self.user, 1)
+        fake = FakeMessaging({'laptop-token': messaging.UnregisteredError('Requested entity was not found.')})
+
+        stats = self.send(fake)
+
+        self.assertEqual(stats['pruned_tokens'], 1)
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, 'sent')
+        self.laptop.refresh_from_db()
+        self.assertFalse(self.laptop.is_active)
+
+    def test_task_returns_the_run_stats(self):
+        create_due_notifications(self.user, 1)
+        fake = FakeMessaging({'laptop-token': messaging.UnregisteredError('Requested entity was not found.')})
+
+        with mock.patch.object(messaging, 'send_each', fake.send_each):
+            result = tasks.send_due_notifications()
+
+        self.assertEqual(result, {'batches': 1, 'deferred': 0, 'pruned_tokens': 1})
+
+    def test_request_failure_fails_every_message_of_the_chunk(self):
+        notification, = create_due_notifications(self.user, 1)
+
+        with mock.patch.object(messaging, 'send_each', side_effect=firebase_exceptions.UnavailableError('Down')):
+            NotificationService.send_due_notifications()
+
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, 'pending')
+        self.assertIn('push: Down', notification.last_error)
+
+    @override_settings(NOTIFICATION_DISPATCH_BATCH_SIZE=1000)
+    def test_messages_are_sent_in_chunks_of_the_fcm_limit(self):
+        self.laptop.delete()
+        create_due_notifications(self.user, FCM_BATCH_SIZE + 1)
+        fake = FakeMessaging()
+
+        self.send(fake)
+
+        self.assertEqual([len(messages) for messages in fake.calls], [FCM_BATCH_SIZE, 1])
+        self.assertEqual(Notification.objects.filter(status='sent').count(), FCM_BATCH_SIZE + 1)
+
+
+class DispatchQueryCountTests(TestCase):
+    """A dispatch run costs the same number of queries however many notifications its batch holds"""
+
+    # Claim (4 with its savepoint), load the batch, device tokens, outbox
+    # lookup and reservation, devices' last_used, outbox acknowledgement,
+    # mark sent, and the empty claim (3) that ends the run
+    QUERIES = 14
+
+    def setUp(self):
+        self.users = [User.objects.create(username=f'user{index}', email=f'user{index}@example.com') for index in range(5)]
+        for user in self.users:
+            DeviceToken.objects.create(user=user, token=f'{user.username}-token', device_type='web')
+
+    def assertDispatchQueries(self, users, per_user):
+        for user in users:
+            create_due_notifications(user, per_user, notification_preference='both')
+        fake = FakeMessaging()
+
+        with mock.patch.object(messaging, 'send_each', fake.send_each), self.assertNumQueries(self.QUERIES):
+            stats = NotificationService.send_due_notifications()
+
+        self.assertEqual(stats['batches'], 1)
+        self.assertEqual(Notification.objects.filter(status='sent').count(), len(users) * per_user)
+
+    def test_one_due_notification(self):
+        self.assertDispatchQueries(self.users[:1], 1)
+
+    def test_many_due_notifications(self):
+        self.assertDispatchQueries(self.users, 10)
+
+
+
+class PriorityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+
+    def create_due(self, title, minutes_ago, **fields):
+        reminder = Reminder.objects.create(user=self.user, title=title, **fields)
+        due = timezone.now() - timedelta(minutes=minutes_ago)
+        return Notification.objects.create(
+            user=self.user, reminder=reminder, title=title, message='Time for your reminder!',
+            scheduled_time=due, priority=Notification.priority_for(reminder)
+        )
+
+    def test_urgent_notifications_are_claimed_before_older_low_priority_ones(self):
+        self.create_due('Old chore', 60)
+        self.create_due('Medium', 30, priority='medium')
+        self.create_due('Flagged', 5, is_flagged=True)
+        self.create_due('High', 1, priority='high')
+
+        claimed = [
+            [notification.title for notification in NotificationService.claim_due_notifications(f'worker{n}', 2)]
+            for n in range(3)
+        ]
+
+        self.assertEqual(claimed, [['Flagged', 'High'], ['Medium', 'Old chore'], []])
+
+    def test_priority_is_recomputed_when_priority_or_flag_changes(self):
+        reminder = Reminder.objects.create(
+            user=self.user, title='Report', date=timezone.now().date() + timedelta(days=1), time=time(9)
+        )
+        SubTask.objects.create(reminder=reminder, title='Draft', date=reminder.date, time=time(8))
+
+        def priorities():
+            return dict(Notification.objects.values_list('kind', 'priority'))
+
+        self.assertEqual(priorities(), {'reminder': Notification.PRIORITY_LOW, 'subtask': Notification.PRIORITY_LOW})
+
+        reminder.priority = 'medium'
+        reminder.save()
+        self.assertEqual(priorities()['reminder'], Notification.PRIORITY_NORMAL)
+
+        reminder.is_flagged = True
+        reminder.save()
+        self.assertEqual(priorities(), {'reminder': Notification.PRIORITY_URGENT, 'subtask': Notification.PRIORITY_LOW})
+
+        subtask = SubTask.objects.get()
+        subtask.priority = 'high'
+        subtask.save()
+        self.assertEqual(priorities()['subtask'], Notification.PRIORITY_URGENT)
+
+        reminder.is_flagged = False
+        reminder.save()
+        self.assertEqual(priorities(), {'reminder': Notification.PRIORITY_NORMAL, 'subtask': Notification.PRIORITY_URGENT})
+
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+        DeviceToken.objects.create(user=self.user, token='phone-token', device_type='web')
+
+    def send(self):
+        fake = FakeMessaging()
+        with mock.patch.object(messaging, 'send_each', fake.send_each):
+            NotificationService.send_due_notifications()
+        return fake
+
+    def test_redispatch_after_a_crash_sends_nothing_again(self):
+        notification, = create_due_notifications(self.user, 1, notification_preference='both')
+
+        # The worker dies after the sends were acknowledged, before the
+        # notification is marked as sent
+        with mock.patch.object(NotificationService, 'finish_batch', side_effect=RuntimeError('worker lost')):
+            with self.assertRaises(RuntimeError):
+                self.send()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            sorted(DeliveryAttempt.objects.values_list('channel', 'status')), [('email', 'sent'), ('push', 'sent')]
+        )
+
+        # Its claim goes stale and another run picks the notification up
+        Notification.objects.filter(pk=notification.pk).update(claimed_at=timezone.now() - timedelta(hours=1))
+        fake = self.send()
+
+        self.assertEqual(fake.calls, [])
+        self.assertEqual(len(mail.outbox), 1)
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.claimed_by), ('sent', ''))
+
+    def test_moved_notification_forgets_its_delivery_attempts(self):
+        reminder = Reminder.objects.create(
+            user=self.user, title='Report', date=timezone.now().date() + timedelta(days=1), time=time(9)
+        )
+        notification = Notification.objects.get(reminder=reminder)
+        DeliveryAttempt.objects.create(
+            notification=notification, channel='push', device=DeviceToken.objects.get(),
+            idempotency_key=f'notification-{notification.id}-push-{DeviceToken.objects.get().id}', status='sent'
+        )
+
+        reminder.date += timedelta(days=1)
+        reminder.save()
+
+        self.assertEqual(Notification.objects.get(reminder=reminder).pk, notification.pk)
+        self.assertFalse(DeliveryAttempt.objects.exists())
+
+        Notification.objects.filter(pk=notification.pk).update(next_attempt_at=timezone.now() - timedelta(minutes=1))
+        fake = self.send()
+
+        self.assertEqual([len(messages) for messages in fake.calls], [1])
+        self.assertEqual(Notification.objects.get(pk=notification.pk).status, 'sent')
+
+
+
+RATE_LIMITS = {
+    # Slow enough that the buckets don't refill during a test
+    'fcm': {'rate': 0.001, 'burst': 2},
+    'smtp': {'rate': 0.001, 'burst': 1},
+}
+
+
+@override_settings(
+    NOTIFICATION_RATE_LIMIT_ENABLED=True,
+    NOTIFICATION_RATE_LIMITS=RATE_LIMITS,
+    NOTIFICATION_DIGEST_ENABLED=True,
+    NOTIFICATION_DIGEST_THRESHOLD=3,
+    NOTIFICATION_DIGEST_WINDOW=60
+)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(redis_client, '_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+        for device in ['phone', 'laptop', 'tablet']:
+            DeviceToken.objects.create(user=self.user, token=f'{device}-token', device_type='web')
+
+    def create_burst(self, notification_preference='push'):
+        """Three notifications due together; the last one is for a high priority reminder"""
+        due = timezone.now() - timedelta(minutes=1)
+        notifications = []
+        for title, priority in [('low1', 'low'), ('low2', 'low'), ('high', 'high')]:
+            reminder = Reminder.objects.create(
+                user=self.user, title=title, priority=priority, notification_preference=notification_preference
+            )
+            notifications.append(Notification.objects.create(
+                user=self.user, reminder=reminder, title=title, message='Time for your reminder!',
+                scheduled_time=due, priority=Notification.priority_for(reminder)
+            ))
+        return notifications
+
+    def send(self):
+        fake = FakeMessaging()
+        with mock.patch.object(messaging, 'send_each', fake.send_each):
+            stats = NotificationService.send_due_notifications()
+        return fake, stats
+
+    def tokens(self, channel):
+        return float(self.redis.hget(rate_limit.RateLimiter.KEY_PREFIX + channel, 'tokens'))
+
+    @override_settings(
+        NOTIFICATION_DIGEST_ENABLED=False,
+        NOTIFICATION_RATE_LIMITS={**RATE_LIMITS, 'fcm': {'rate': 0.001, 'burst': 4}}
+    )
+    def test_over_budget_notifications_are_deferred_not_failed(self):
+        first, second = create_due_notifications(self.user, 2)
+        due = second.next_attempt_at
+
+        fake, stats = self.send()
+
+        # Each notification needs one push per device (3); the burst covers one
+        self.assertEqual([len(messages) for messages in fake.calls], [3])
+        self.assertEqual(stats['deferred'], 1)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.status, 'sent')
+        self.assertEqual((second.status, second.attempts, second.last_error), ('pending', 0, ''))
+        self.assertEqual((second.claimed_at, second.claimed_by), (None, ''))
+        # Pushed back until the bucket has refilled for its 3 messages
+        self.assertGreaterEqual(second.next_attempt_at, due + timedelta(seconds=3000))
+        self.assertEqual(self.tokens('fcm'), 1)
+
+    def test_digest_over_the_push_budget_is_deferred_whole(self):
+        self.create_burst()
+
+        fake, stats = self.send()
+
+        # The digest needs one push per device (3), more than the burst of 2
+        self.assertEqual(fake.calls, [])
+        self.assertEqual(stats['deferred'], 3)
+        for notification in Notification.objects.all():
+            self.assertEqual((notification.status, notification.attempts), ('pending', 0))
+            self.assertGreater(notification.next_attempt_at, timezone.now())
+        self.assertEqual(self.tokens('fcm'), 2)
+
+    @override_settings(NOTIFICATION_RATE_LIMITS={**RATE_LIMITS, 'fcm': {'rate': 0.001, 'burst': 3}})
+    def test_digest_is_charged_one_push_per_device(self):
+        self.create_burst()
+
+        fake, stats = self.send()
+
+        self.assertEqual([len(messages) for messages in fake.calls], [3])
+        self.assertEqual(fake.calls[0][0].notification.title, 'You have 3 reminders due')
+        self.assertEqual(stats['deferred'], 0)
+        self.assertEqual(Notification.objects.filter(status='sent').count(), 3)
+        self.assertEqual(self.tokens('fcm'), 0)
+
+    def test_digest_email_is_charged_once(self):
+        self.create_burst(notification_preference='email')
+
+        fake, stats = self.send()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(stats['deferred'], 0)
+        self.assertEqual(Notification.objects.filter(status='sent').count(), 3)
+        self.assertEqual(self.tokens('smtp'), 0)
+
+
+
+class TimingWheelTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.wheel = timing_wheel.TimingWheel(client=self.redis)
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+        self.reminder = Reminder.objects.create(user=self.user, title='Report')
+        self.now = timezone.now()
+
+    def create_notification(self, minutes, status='pending'):
+        due = self.now + timedelta(minutes=minutes)
+        return Notification.objects.create(
+            user=self.user, reminder=self.reminder, title='Report', message='Time for your reminder!',
+            scheduled_time=due, next_attempt_at=due, status=status
+        )
+
+    def members(self):
+        return {int(member): score for member, score in self.redis.zrange(self.wheel.KEY, 0, -1, withscores=True)}
+
+    def test_pop_due_returns_due_ids_in_order_and_removes_them(self):
+        later, first, second, future = [self.create_notification(minutes) for minutes in (-1, -3, -2, 5)]
+        self.wheel.add([later, first, second, future])
+
+        self.assertEqual(self.wheel.pop_due(self.now, limit=2), [first.id, second.id])
+        self.assertEqual(self.wheel.pop_due(self.now), [later.id])
+        self.assertEqual(self.wheel.pop_due(self.now), [])
+        self.assertEqual(list(self.members()), [future.id])
+
+    def test_reconcile_repairs_missing_and_stale_entries(self):
+        kept = self.create_notification(1)
+        missing = self.create_notification(2)
+        rescheduled = self.create_notification(3)
+        sent = self.create_notification(-1, status='sent')
+        beyond_horizon = self.create_notification(60 * 48)
+        self.wheel.add([kept, rescheduled, sent])
+        # The retry moved the attempt after it was added to the wheel
+        Notification.objects.filter(pk=rescheduled.pk).update(next_attempt_at=self.now + timedelta(minutes=10))
+        self.redis.zadd(self.wheel.KEY, {'999999': self.now.timestamp()})
+
+        self.assertEqual(self.wheel.reconcile(), (2, 2))
+
+        self.assertEqual(self.members(), {
+            kept.id: kept.next_attempt_at.timestamp(),
+            missing.id: missing.next_attempt_at.timestamp(),
+            rescheduled.id: (self.now + timedelta(minutes=10)).timestamp(),
+        })
+        self.assertNotIn(beyond_horizon.id, self.members())
+        self.assertEqual(self.wheel.reconcile(), (0, 0))
+
+
+class TokenBucketTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.limiter = rate_limit.RateLimiter(client=self.redis, limits={'fcm': {'rate': 1, 'burst': 5}})
+        self.key = rate_limit.RateLimiter.KEY_PREFIX + 'fcm'
+
+    def rewind(self, seconds):
+        """Pretend the bucket was last updated `seconds` earlier"""
+        updated_at = float(self.redis.hget(self.key, 'updated_at'))
+        self.redis.hset(self.key, 'updated_at', str(updated_at - seconds))
+
+    def test_bucket_runs_out(self):
+        self.assertEqual(self.limiter.acquire('fcm', 3), 3)
+        self.assertEqual(self.limiter.acquire('fcm', 3), 2)
+        self.assertEqual(self.limiter.acquire('fcm', 1), 0)
+
+    def test_bucket_refills_at_the_rate_up_to_the_burst(self):
+        self.assertEqual(self.limiter.acquire('fcm', 5), 5)
+
+        self.rewind(2.5)
+        self.assertEqual(self.limiter.acquire('fcm', 5), 2)
+
+        self.rewind(60)
+        self.assertEqual(self.limiter.acquire('fcm', 10), 5)
+
+    def test_refund_returns_unused_tokens(self):
+        self.assertEqual(self.limiter.acquire('fcm', 5), 5)
+        self.limiter.refund('fcm', 2)
+
+        self.assertEqual(self.limiter.acquire('fcm', 5), 2)
+
+    def test_unlimited_channels_and_an_unavailable_redis_are_not_throttled(self):
+        self.assertEqual(self.limiter.acquire('smtp', 100), 100)
+
+        with mock.patch.object(self.redis, 'eval', side_effect=redis.ConnectionError('down')):
+            self.assertEqual(self.limiter.acquire('fcm', 100), 100)
+
+
+
+@override_settings(NOTIFICATION_DELIVERY_BACKEND='async')
+class DeliveryEngineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+        DeviceToken.objects.create(user=self.user, token='phone-token', device_type='web')
+        DeviceToken.objects.create(user=self.user, token='laptop-token', device_type='web')
+
+    def test_drain_delivers_push_and_email(self):
+        create_due_notifications(self.user, 3, notification_preference='both')
+        fake = FakeMessaging({'laptop-token': messaging.UnregisteredError('Requested entity was not found.')})
+
+        with mock.patch.object(messaging, 'send_each', fake.send_each):
+            stats = NotificationService.send_due_notifications(batch_size=2)
+
+        self.assertEqual(stats, {'batches': 2, 'deferred': 0, 'pruned_tokens': 1})
+        self.assertEqual([len(messages) for messages in fake.calls], [4, 1])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(Notification.objects.filter(status='sent').count(), 3)
+        self.assertEqual(DeliveryAttempt.objects.filter(status='sent').count(), 6)
+        self.assertFalse(DeviceToken.objects.get(token='laptop-token').is_active)
+
+    def test_lane_closes_old_connections_before_each_claim(self):
+        calls = []
+
+        def claim(worker_id, priorities):
+            calls.append(('claim', threading.get_ident()))
+            if len(calls) == 4:
+                # Stop the endless lane on its second claim
+                raise asyncio.CancelledError
+            return []
+
+        def close():
+            calls.append(('close', threading.get_ident()))
+
+        with mock.patch.object(DeliveryEngine, 'claim_next_batch', side_effect=claim), \
+                mock.patch.object(delivery_engine, 'close_old_connections', side_effect=close):
+            with self.assertRaises(asyncio.CancelledError):
+                async_to_sync(DeliveryEngine().run_lane)('worker', 0)
+
+        self.assertEqual([name for name, _ in calls], ['close', 'claim', 'close', 'claim'])
+        # In the thread that runs the lane's database calls
+        self.assertEqual(len({thread for _, thread in calls}), 1)
+
+
+
+class EmailRenderTests(TestCase):
+    def test_html_body_escapes_titles_and_messages(self):
+        item = SimpleNamespace(date=date(2026, 10, 20), time=time(9, 30))
+        context = email_templates.build_context('Pay <bills>', 'Rent & power', item, 'reminder')
+
+        subject, plain_message, html_message = email_templates.render_email(context)
+
+        self.assertEqual(subject, 'Reminder: Pay <bills>')
+        self.assertIn('<h1>Pay &lt;bills&gt;</h1>', html_message)
+        self.assertIn('<p>Rent &amp; power</p>', html_message)
+        self.assertIn('<p><strong>Date:</strong> Tuesday, October 20, 2026</p>', html_message)
+        self.assertIn('Pay <bills>', plain_message)
+        self.assertIn('When: Tuesday, October 20, 2026 09:30 AM', plain_message)
+
+    def test_digest_lists_every_item(self):
+        no_date = SimpleNamespace(date=None, time=None)
+        context = email_templates.build_digest_context([
+            ('Report', 'Time for your reminder!', no_date, 'reminder'),
+            ('Draft', 'Time for your subtask!', no_date, 'subtask'),
+        ])
+
+        (subject, plain_message, html_message), = email_templates.render_email_batch([context])
+
+        self.assertEqual(subject, 'Reminders: 2 due now')
+        self.assertEqual(html_message.count('<div class="reminder">'), 2)
+        self.assertIn('<h2>Draft</h2>', html_message)
+        self.assertIn('Draft\nType: Subtask', plain_message)
+        self.assertEqual(plain_message.count('When: No date'), 2)
+
+
+
+@override_settings(NOTIFICATION_RECURRENCE_WINDOW_DAYS=7, NOTIFICATION_RECURRENCE_REFILL_DAYS=2)
+class RecurringRefillTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+        self.now = timezone.now()
+
+    def create_daily(self, title='Standup'):
+        return Reminder.objects.create(
+            user=self.user, title=title, date=self.now.date() + timedelta(days=1), time=time(9), repeat='daily'
+        )
+
+    def occurrences(self, reminder):
+        return list(
+            Notification.objects.filter(reminder=reminder).order_by('scheduled_time').values_list('scheduled_time', flat=True)
+        )
+
+    def test_refill_advances_the_watermark(self):
+        reminder = self.create_daily()
+        reminder.refresh_from_db()
+        self.assertGreaterEqual(reminder.materialized_until, self.now + timedelta(days=7))
+        scheduled = self.occurrences(reminder)
+        self.assertLessEqual(scheduled[-1], reminder.materialized_until)
+
+        # Six days later the window ends within the refill margin
+        later = self.now + timedelta(days=6)
+        result = tasks.refill_recurring_chunk([reminder.pk], now=later.isoformat())
+
+        reminder.refresh_from_db()
+        self.assertEqual(result['reminders'], 1)
+        self.assertGreater(result['notifications'], 0)
+        self.assertEqual(reminder.materialized_until, later + timedelta(days=7))
+        refilled = self.occurrences(reminder)
+        self.assertEqual(refilled[:len(scheduled)], scheduled)
+        self.assertGreater(refilled[len(scheduled)], scheduled[-1])
+        self.assertLessEqual(refilled[-1], reminder.materialized_until)
+
+    def test_refilling_twice_creates_no_duplicates(self):
+        reminder = self.create_daily()
+        later = self.now + timedelta(days=6)
+
+        tasks.refill_recurring_chunk([reminder.pk], now=later.isoformat())
+        refilled = self.occurrences(reminder)
+        self.assertEqual(tasks.refill_recurring_chunk([reminder.pk], now=later.isoformat()), {'reminders': 0, 'notifications': 0})
+
+        reminder.refresh_from_db()
+        self.assertEqual(NotificationService.materialize_recurring_notifications(reminder, now=later), [])
+        self.assertEqual(self.occurrences(reminder), refilled)
+        self.assertEqual(len(refilled), len(set(refilled)))
+
+    @override_settings(NOTIFICATION_RECURRENCE_CHUNK_SIZE=2)
+    def test_coordinator_fans_out_chunks(self):
+        reminders = [self.create_daily(f'Standup {index}') for index in range(5)]
+        Reminder.objects.create(user=self.user, title='Once', date=self.now.date(), time=time(9))
+        # Already refilled far enough, so it's left out
+        Reminder.objects.filter(pk=reminders[2].pk).update(materialized_until=self.now + timedelta(days=30))
+
+        later = self.now + timedelta(days=6)
+        with mock.patch('django.utils.timezone.now', return_value=later), \
+                mock.patch.object(tasks.refill_recurring_chunk, 'delay') as delay:
+            progress = tasks.reschedule_recurring_reminders(days_ahead=7)
+
+        self.assertEqual(progress, {'reminders': 4, 'chunks': 2})
+        chunks = [call.args[0] for call in delay.call_args_list]
+        expected = [reminder.pk for reminder in reminders if reminder is not reminders[2]]
+        self.assertEqual(chunks, [expected[:2], expected[2:]])
+        self.assertEqual({call.args[1:] for call in delay.call_args_list}, {(7, later.isoformat())})
+
+    @override_settings(NOTIFICATION_RECURRENCE_CHUNK_SIZE=2)
+    def test_rerunning_the_coordinator_only_picks_up_what_is_left(self):
+        for index in range(3):
+            self.create_daily(f'Standup {index}')
+        later = self.now + timedelta(days=6)
+
+        with mock.patch('django.utils.timezone.now', return_value=later), \
+                mock.patch.object(tasks.refill_recurring_chunk, 'delay', side_effect=tasks.refill_recurring_chunk):
+            first = tasks.reschedule_recurring_reminders()
+            count = Notification.objects.count()
+            second = tasks.reschedule_recurring_reminders()
+
+        self.assertEqual(first, {'reminders': 3, 'chunks': 2})
+        self.assertEqual(second, {'reminders': 0, 'chunks': 0})
+        self.assertEqual(Notification.objects.count(), count)
+
+
+
+class ReminderSchedulingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+        tomorrow = timezone.now().date() + timedelta(days=1)
+        self.reminder = Reminder.objects.create(user=self.user, title='Report', date=tomorrow, time=time(9))
+        self.subtask = SubTask.objects.create(reminder=self.reminder, title='Draft', date=tomorrow, time=time(8))
+        due = timezone.now() - timedelta(minutes=1)
+        Notification.objects.create(
+            user=self.user, reminder=self.reminder, kind='overdue', title='Overdue: Report',
+            message='This reminder was due yesterday', scheduled_time=due
+        )
+
+    def pending_kinds(self):
+        return sorted(Notification.objects.filter(status='pending').values_list('kind', flat=True))
+
+    def test_completing_a_reminder_drops_its_pending_notifications(self):
+        Notification.objects.filter(kind='overdue').update(status='sent', sent=True, sent_at=timezone.now())
+        self.assertEqual(self.pending_kinds(), ['reminder', 'subtask'])
+
+        self.reminder.mark_as_completed()
+
+        self.assertEqual(self.pending_kinds(), [])
+        self.assertEqual(list(Notification.objects.values_list('kind', 'status')), [('overdue', 'sent')])
+
+    def test_clearing_the_date_drops_its_pending_notifications(self):
+        self.reminder.date = None
+        self.reminder.save()
+
+        self.assertEqual(self.pending_kinds(), [])
+
+    def test_completing_a_subtask_drops_its_pending_overdue_notification(self):
+        Notification.objects.create(
+            user=self.user, reminder=self.reminder, subtask=self.subtask, kind='overdue', title='Overdue: Draft',
+            message='This subtask was due yesterday', scheduled_time=timezone.now() - timedelta(minutes=1)
+        )
+
+        self.subtask.is_completed = True
+        self.subtask.save()
+
+        self.assertFalse(Notification.objects.filter(subtask=self.subtask).exists())
+        self.assertEqual(self.pending_kinds(), ['overdue', 'reminder'])
+
+    def reschedule_claimed_reminder(self, claimed_at):
+        notification = Notification.objects.get(kind='reminder')
+        Notification.objects.filter(pk=notification.pk).update(claimed_at=claimed_at, claimed_by='worker')
+
+        self.reminder.date += timedelta(days=1)
+        self.reminder.save()
+        return notification
+
+    def test_claimed_notification_is_not_moved(self):
+        claimed = self.reschedule_claimed_reminder(timezone.now())
+
+        in_flight, rescheduled = Notification.objects.filter(kind='reminder').order_by('scheduled_time')
+        self.assertEqual((in_flight.pk, in_flight.scheduled_time), (claimed.pk, claimed.scheduled_time))
+        self.assertEqual(rescheduled.scheduled_time, claimed.scheduled_time + timedelta(days=1))
+
+    def test_stale_claim_is_moved(self):
+        claimed = self.reschedule_claimed_reminder(timezone.now() - timedelta(hours=1))
+
+        row, = Notification.objects.filter(kind='reminder')
+        self.assertEqual(row.pk, claimed.pk)
+        self.assertEqual(row.scheduled_time, claimed.scheduled_time + timedelta(days=1))
+
+
+
+@override_settings(NOTIFICATION_ASYNC_SCHEDULING=True)
+class AsyncReschedulingTests(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(redis_client, '_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(tasks.reschedule_notifications, 'delay')
+        self.delay = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+        self.tomorrow = timezone.now().date() + timedelta(days=1)
+
+    def save(self, reminder, **fields):
+        """Save changes to the reminder in a transaction and run its on_commit callbacks"""
+        with self.captureOnCommitCallbacks(execute=True):
+            for name, value in fields.items():
+                setattr(reminder, name, value)
+            reminder.save()
+
+    def test_saves_in_one_transaction_enqueue_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reminder = Reminder.objects.create(user=self.user, title='Report', date=self.tomorrow, time=time(9))
+            for hour in (10, 11, 12):
+                reminder.time = time(hour)
+                reminder.save()
+
+        self.delay.assert_called_once_with('reminder', reminder.pk)
+        self.assertFalse(Notification.objects.exists())
+
+        # Still queued, so a later save doesn't enqueue another job
+        self.save(reminder, time=time(13))
+        self.assertEqual(self.delay.call_count, 1)
+        self.assertTrue(self.redis.exists(reschedule.get_key('reminder', reminder.pk)))
+
+    def test_save_after_the_task_starts_enqueues_again(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reminder = Reminder.objects.create(user=self.user, title='Report', date=self.tomorrow, time=time(9))
+        schedule = NotificationService.schedule_notifications_for_reminder
+
+        def save_while_running(instance):
+            # A request saves the reminder while the worker reschedules it
+            self.save(Reminder.objects.get(pk=instance.pk), time=time(10))
+            return schedule(instance)
+
+        with mock.patch.object(NotificationService, 'schedule_notifications_for_reminder', side_effect=save_while_running):
+            tasks.reschedule_notifications('reminder', reminder.pk)
+
+        self.assertEqual(self.delay.call_args_list, [mock.call('reminder', reminder.pk)] * 2)
+
+        tasks.reschedule_notifications('reminder', reminder.pk)
+        self.assertFalse(self.redis.exists(reschedule.get_key('reminder', reminder.pk)))
+        self.assertEqual(timezone.localtime(Notification.objects.get().scheduled_time).time(), time(10))
+
+    def test_subtasks_have_their_own_marker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reminder = Reminder.objects.create(user=self.user, title='Report', date=self.tomorrow, time=time(9))
+            subtask = SubTask.objects.create(reminder=reminder, title='Draft', date=self.tomorrow, time=time(8))
+            subtask.title = 'First draft'
+            subtask.save()
+
+        self.assertEqual(self.delay.call_args_list, [mock.call('reminder', reminder.pk), mock.call('subtask', subtask.pk)])
+
+
+
+class TimezoneCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='kenji', email='kenji@example.com')
+        self.user.userprofile.timezone = 'Asia/Tokyo'
+        self.user.userprofile.save()
+
+    def test_timezone_is_cached_across_user_objects(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(str(timezones.get_user_timezone(User(pk=self.user.pk))), 'Asia/Tokyo')
+        with self.assertNumQueries(0):
+            self.assertEqual(str(timezones.get_user_timezone(User(pk=self.user.pk))), 'Asia/Tokyo')
+        self.assertEqual(cache.get(timezones.get_cache_key(self.user.pk)), 'Asia/Tokyo')
+
+    def test_profile_save_invalidates_the_cache(self):
+        timezones.get_user_timezone(User(pk=self.user.pk))
+
+        profile = UserProfile.objects.get(user=self.user)
+        profile.timezone = 'Europe/Paris'
+        profile.save()
+
+        self.assertIsNone(cache.get(timezones.get_cache_key(self.user.pk)))
+        self.assertEqual(str(timezones.get_user_timezone(User(pk=self.user.pk))), 'Europe/Paris')
+
+    @override_settings(TIMEZONE_CACHE_TTL=60)
+    def test_entries_expire_after_the_ttl(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            timezones.get_user_timezone(User(pk=self.user.pk))
+
+        cache_set.assert_called_once_with(timezones.get_cache_key(self.user.pk), 'Asia/Tokyo', 60)
+
+
+
+class OverdueSweepTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='kenji', email='kenji@example.com')
+        self.user.userprofile.timezone = 'Asia/Tokyo'
+        self.user.userprofile.save()
+        self.reminder = Reminder(user=self.user, title='Breakfast')
+        # 08:00 in Tokyo on Oct 20 is stored as Oct 19, 23:00 UTC
+        self.reminder.set_local_scheduled_time(self.user, datetime(2026, 10, 20, 8, 0))
+        self.reminder.save()
+
+    def sweep(self, utc_now):
+        with mock.patch('django.utils.timezone.now', return_value=utc_now):
+            tasks.check_overdue_items_by_timezone()
+        return list(Notification.objects.filter(kind='overdue').values_list('title', 'message'))
+
+    def test_not_overdue_at_midnight_before_it_is_due(self):
+        # Midnight of Oct 20 in Tokyo
+        self.assertEqual(self.sweep(datetime(2026, 10, 19, 15, 5, tzinfo=dt_timezone.utc)), [])
+
+    def test_overdue_at_the_next_local_midnight(self):
+        # Midnight of Oct 21 in Tokyo
+        self.assertEqual(
+            self.sweep(datetime(2026, 10, 20, 15, 5, tzinfo=dt_timezone.utc)),
+            [('Overdue: Breakfast', 'This reminder was due yesterday')]
+        )
+
+    def test_subtasks_compare_their_utc_time_too(self):
+        SubTask.objects.create(reminder=self.reminder, title='Coffee', date=date(2026, 10, 19), time=time(22, 0))
+        self.reminder.mark_as_completed()
+
+        self.assertEqual(self.sweep(datetime(2026, 10, 19, 15, 5, tzinfo=dt_timezone.utc)), [])
+        self.assertEqual(
+            self.sweep(datetime(2026, 10, 20, 15, 5, tzinfo=dt_timezone.utc)),
+            [('Overdue: Coffee', 'This subtask was due yesterday')]
+        )
+
+    def test_a_late_run_still_sweeps_the_day(self):
+        OverdueSweep.objects.create(timezone='Asia/Tokyo', last_swept=date(2026, 10, 20))
+
+        # 03:05 on Oct 21 in Tokyo, after the runs around midnight were missed
+        self.assertEqual(
+            self.sweep(datetime(2026, 10, 20, 18, 5, tzinfo=dt_timezone.utc)),
+            [('Overdue: Breakfast', 'This reminder was due yesterday')]
+        )
+        self.assertEqual(OverdueSweep.objects.get(timezone='Asia/Tokyo').last_swept, date(2026, 10, 21))
+
+    def test_a_day_is_only_swept_once(self):
+        self.sweep(datetime(2026, 10, 20, 15, 5, tzinfo=dt_timezone.utc))
+        Notification.objects.filter(kind='overdue').delete()
+
+        self.assertEqual(self.sweep(datetime(2026, 10, 20, 18, 5, tzinfo=dt_timezone.utc)), [])
+
+    def test_a_new_timezone_waits_for_its_next_midnight(self):
+        # 03:05 on Oct 21 in Tokyo, with no sweep recorded yet
+        self.assertEqual(self.sweep(datetime(2026, 10, 20, 18, 5, tzinfo=dt_timezone.utc)), [])
+        self.assertFalse(OverdueSweep.objects.filter(timezone='Asia/Tokyo').exists())
+
+    def test_a_day_starting_after_a_skipped_midnight_is_swept(self):
+        self.user.userprofile.timezone = 'America/Havana'
+        self.user.userprofile.save()
+        self.reminder.set_local_scheduled_time(self.user, datetime(2026, 3, 7, 8, 0))
+        self.reminder.save()
+
+        # Havana skips from 00:00 to 01:00 on Mar 8; 01:10 there is 05:10 UTC
+        self.assertEqual(
+            self.sweep(datetime(2026, 3, 8, 5, 10, tzinfo=dt_timezone.utc)),
+            [('Overdue: Breakfast', 'This reminder was due yesterday')]
+        )
+
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = FileSystemStorage(location=directory.name)
+
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+        self.device = DeviceToken.objects.create(user=self.user, token='phone-token', device_type='web')
+        self.sent_at = timezone.now() - timedelta(days=60)
+        self.notifications = create_due_notifications(self.user, 3)
+        Notification.objects.update(status='sent', sent=True, sent_at=self.sent_at)
+        for notification in self.notifications:
+            DeliveryAttempt.objects.create(
+                notification=notification, channel='push', device=self.device,
+                idempotency_key=f'notification-{notification.id}-push-{self.device.id}', status='sent'
+            )
+        DeliveryAttempt.objects.update(created_at=self.sent_at, updated_at=self.sent_at)
+
+    def test_archive_keeps_delivery_attempts(self):
+        manifest_name = archive.archive_notifications(timezone.now() - timedelta(days=30), chunk_size=2, storage=self.storage)
+
+        self.assertFalse(Notification.objects.exists())
+        self.assertFalse(DeliveryAttempt.objects.exists())
+        with self.storage.open(manifest_name) as f:
+            manifest = json.load(f)
+        self.assertEqual((manifest['rows'], manifest['attempts']), (3, 3))
+        self.assertEqual([chunk['attempts']['rows'] for chunk in manifest['chunks']], [2, 1])
+
+        self.device.delete()
+        self.assertEqual(archive.restore_archive(manifest_name, storage=self.storage), 3)
+
+        self.assertEqual(Notification.objects.filter(sent_at=self.sent_at).count(), 3)
+        attempts = DeliveryAttempt.objects.order_by('notification_id')
+        self.assertEqual([attempt.notification_id for attempt in attempts], [n.id for n in self.notifications])
+        for attempt in attempts:
+            self.assertIsNone(attempt.device_id)
+            self.assertEqual((attempt.created_at, attempt.updated_at), (self.sent_at, self.sent_at))
+
+    def test_archive_without_delete_copies_any_rows(self):
+        Notification.objects.filter(pk=self.notifications[0].pk).update(status='dead', sent=False, sent_at=None)
+
+        manifest_name = archive.archive_notifications(
+            timezone.now(), storage=self.storage, notifications=Notification.objects.all(), delete=False
+        )
+
+        with self.storage.open(manifest_name) as f:
+            manifest = json.load(f)
+        self.assertEqual((manifest['rows'], manifest['attempts']), (3, 3))
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertEqual(DeliveryAttempt.objects.count(), 3)
+
+    def test_runs_in_the_same_second_keep_their_own_manifest(self):
+        run = timezone.now()
+        with mock.patch('django.utils.timezone.now', return_value=run):
+            first = archive.archive_notifications(
+                run, storage=self.storage, notifications=Notification.objects.all(), delete=False
+            )
+            second = archive.archive_notifications(
+                run, storage=self.storage, notifications=Notification.objects.filter(pk=self.notifications[0].pk), delete=False
+            )
+
+        self.assertNotEqual(first, second)
+        with self.storage.open(first) as f:
+            self.assertEqual(json.load(f)['rows'], 3)
+        with self.storage.open(second) as f:
+            self.assertEqual(json.load(f)['rows'], 1)
+
+    def test_restore_keeps_the_timestamps_of_existing_rows(self):
+        manifest_name = archive.archive_notifications(
+            timezone.now(), storage=self.storage, notifications=Notification.objects.all(), delete=False
+        )
+        edited_at = timezone.now()
+        DeliveryAttempt.objects.filter(notification=self.notifications[0]).update(updated_at=edited_at)
+        DeliveryAttempt.objects.filter(notification=self.notifications[1]).delete()
+
+        archive.restore_archive(manifest_name, storage=self.storage)
+
+        attempts = DeliveryAttempt.objects.order_by('notification_id')
+        self.assertEqual(
+            [attempt.updated_at for attempt in attempts], [edited_at, self.sent_at, self.sent_at]
+        )
+
+
+
+class ReminderApiQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.reminder = Reminder.objects.create(user=self.user, title='Report')
+
+    # Count, the page, the prefetched tags, subtasks and subtasks' tags; the
+    # tag endpoint also loads the tag
+    LIST_QUERIES = 5
+
+    def create_reminders(self, count):
+        other = User.objects.create(username=f'bob{count}', email=f'bob{count}@example.com')
+        tag = Tag.objects.create(user=self.user, name='work')
+        tomorrow = timezone.now().date() + timedelta(days=1)
+
+        for index in range(count):
+            # Every other reminder is shared with alice by bob, the rest are shared by alice with bob
+            owner, shared_with = (other, self.user) if index % 2 else (self.user, other)
+            reminder = Reminder.objects.create(
+                user=owner, title=f'Reminder {index}', date=tomorrow, time=time(9), is_flagged=True
+            )
+            reminder.tags.add(tag)
+            SubTask.objects.create(reminder=reminder, title='Step').tags.add(tag)
+            SharedReminder.objects.create(reminder=reminder, shared_with=shared_with, shared_by=owner, permissions='edit')
+        return tag
+
+    def assertListQueries(self, url, count=LIST_QUERIES, owned_only=False):
+        for size in (5, 30):
+            with self.subTest(reminders=size):
+                Reminder.objects.all().delete()
+                Tag.objects.all().delete()
+                tag = self.create_reminders(size)
+
+                with self.assertNumQueries(count):
+                    response = self.client.get(url.format(tag=tag.pk))
+
+                self.assertEqual(response.status_code, 200)
+                statuses = [reminder['sharing_status'] for reminder in response.data['results']]
+                self.assertEqual(statuses.count('shared_by_me'), (size + 1) // 2)
+                self.assertEqual(statuses.count('shared_with_me_edit'), 0 if owned_only else size // 2)
+
+    def test_list(self):
+        self.assertListQueries('/api/reminders/')
+
+    def test_upcoming(self):
+        self.assertListQueries('/api/reminders/upcoming/')
+
+    def test_scheduled(self):
+        self.assertListQueries('/api/reminders/scheduled/')
+
+    def test_flagged(self):
+        self.assertListQueries('/api/reminders/flagged/')
+
+    def test_tag_reminders(self):
+        # Only the user's own reminders are listed by tag
+        self.assertListQueries('/api/tags/{tag}/reminders/', self.LIST_QUERIES + 1, owned_only=True)
+
+    def test_toggle_flag_skips_the_list_eager_loading(self):
+        # Load the reminder, save the flag and re-prioritize its pending notifications
+        with self.assertNumQueries(3):
+            response = self.client.post(f'/api/reminders/{self.reminder.pk}/toggle_flag/')
+        self.assertEqual(response.status_code, 200)
+
+
+def step_recurrence(reminder, end_date, future_days):
+    """
+    The stepping loop schedule_recurring_reminders used before the recurrence
+    engine, kept as the reference the engine is fuzzed against. Hourly repeats
+    return the notification times the loop created instead of creating them.
+    """
+    if reminder.repeat_end_date and reminder.date > reminder.repeat_end_date:
+        return []
+
+    def add_months(current_date, months):
+        month = current_date.month + months
+        year = current_date.year
+        while month > 12:
+            month -= 12
+            year += 1
+        day = min(current_date.day, [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
+        return current_date.replace(year=year, month=month, day=day)
+
+    next_dates = []
+    hourly = []
+    current_date = reminder.date
+
+    while current_date <= end_date:
+        if reminder.repeat == 'daily':
+            current_date += timedelta(days=1)
+        elif reminder.repeat == 'weekdays':
+            current_date += timedelta(days=1)
+            while current_date.weekday() >= 5:
+                current_date += timedelta(days=1)
+        elif reminder.repeat == 'weekends':
+            current_date += timedelta(days=1)
+            while current_date.weekday() < 5:
+                current_date += timedelta(days=1)
+        elif reminder.repeat == 'weekly':
+            current_date += timedelta(weeks=1)
+        elif reminder.repeat == 'biweekly':
+            current_date += timedelta(weeks=2)
+        elif reminder.repeat == 'monthly':
+            current_date = add_months(current_date, 1)
+        elif reminder.repeat == 'quarterly':
+            current_date = add_months(current_date, 3)
+        elif reminder.repeat == 'biannually':
+            current_date = add_months(current_date, 6)
+        elif reminder.repeat == 'yearly':
+            current_date = current_date.replace(year=current_date.year + 1)
+        elif reminder.repeat == 'hourly':
+            if reminder.time:
+                reminder_datetime = timezone.make_aware(timezone.datetime.combine(current_date, reminder.time))
+                for i in range(1, min(24, future_days)):
+                    next_datetime = reminder_datetime + timedelta(hours=i)
+                    if next_datetime.date() == current_date:
+                        hourly.append(next_datetime)
+            current_date += timedelta(days=1)
+            continue
+        elif reminder.repeat == 'custom' and reminder.custom_repeat_interval:
+            interval = reminder.custom_repeat_interval
+            if 'days' in interval:
+                current_date += timedelta(days=interval['days'])
+            elif 'weeks' in interval:
+                current_date += timedelta(weeks=interval['weeks'])
+            elif 'months' in interval:
+                current_date = add_months(current_date, interval['months'])
+            else:
+                current_date += timedelta(days=1)
+        else:
+            break
+
+        if current_date <= end_date:
+            next_dates.append(current_date)
+
+    return hourly if reminder.repeat == 'hourly' else next_dates
+
+
+class RecurrenceFuzzTests(TestCase):
+    """The closed-form recurrence engine yields the same occurrences as the old stepping loop"""
+
+    CASES = 20000
+    REPEATS = [
+        'never', 'hourly', 'daily', 'weekdays', 'weekends', 'weekly', 'biweekly',
+        'monthly', 'quarterly', 'biannually', 'yearly', 'custom',
+    ]
+
+    def random_reminder(self, rng):
+        start = date(2000, 1, 1) + timedelta(days=rng.randrange(365 * 40))
+        if rng.random() < 0.3:
+            # Month ends exercise the day clamping
+            start = start.replace(day=rng.randint(28, calendar.monthrange(start.year, start.month)[1]))
+
+        repeat = rng.choice(self.REPEATS)
+        interval = None
+        if repeat == 'custom':
+            unit = rng.choice(['days', 'weeks', 'months', 'other', None])
+            interval = None if unit is None else {unit: rng.randrange(1, 15)}
+
+        return SimpleNamespace(
+            repeat=repeat,
+            date=start,
+            time=time(rng.randrange(24), rng.randrange(60)) if rng.random() > 0.2 else None,
+            repeat_end_date=None if rng.random() < 0.5 else start + timedelta(days=rng.randrange(-30, 2000)),
+            custom_repeat_interval=interval
+        )
+
+    def test_matches_stepping_loop(self):
+        rng = random.Random(20261018)
+        compared = 0
+
+        for _ in range(self.CASES):
+            reminder = self.random_reminder(rng)
+            future_days = rng.choice([1, 5, 30, 90, 365, 2000])
+            today = reminder.date + timedelta(days=rng.randrange(-400, 400))
+            end_date = reminder.repeat_end_date or today + timedelta(days=future_days)
+            if reminder.repeat == 'hourly':
+                # Every day repeats the same hours, so a short range is enough
+                end_date = min(end_date, reminder.date + timedelta(days=31))
+
+            try:
+                expected = step_recurrence(reminder, end_date, future_days)
+            except ValueError:
+                # The old loop crashed on yearly repeats from Feb 29
+                continue
+
+            rule = recurrence.compile_rule(reminder, future_days)
+            actual = rule.through(end_date) if rule else []
+            self.assertEqual(actual, expected, f"{reminder} through {end_date} ({future_days} days)")
+            compared += 1
+
+        self.assertGreater(compared, self.CASES * 0.99)
+
+    def test_incomplete_rules_fail_when_created(self):
+        class EveryOtherDay(recurrence.Recurrence):
+            def nth(self, n):
+                return self.start + timedelta(days=2 * n)
+
+        with self.assertRaises(TypeError):
+            EveryOtherDay(date(2026, 10, 18))
+        with self.assertRaises(TypeError):
+            recurrence.Recurrence(date(2026, 10, 18))
+
+    def test_next_after_matches_enumeration(self):
+        rng = random.Random(5)
+        for _ in range(3000):
+            start = date(2000, 1, 1) + timedelta(days=rng.randrange(15000))
+            rule = rng.choice([
+                recurrence.DailyRecurrence(start, rng.randint(1, 20)),
+                recurrence.MonthlyRecurrence(start, rng.randint(1, 30)),
+                recurrence.WeekdayRecurrence(start, rng.choice([(0, 1, 2, 3, 4), (5, 6)])),
+            ])
+            occurrences = [rule.nth(n) for n in range(1, 60)]
+            self.assertEqual(occurrences, sorted(set(occurrences)))
+
+            day = start + timedelta(days=rng.randrange(-40, 500))
+            expected = next((occurrence for occurrence in occurrences if occurrence > day), None)
+            if expected is not None:
+                self.assertEqual(rule.next_after(day), expected)
@@ -0,0 +1,59 @@
+import pytz
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+
+
+@lru_cache(maxsize=None)
+def get_timezone(name):
+    """Return the pytz timezone for a name, or UTC if it isn't a valid one"""
+    try:
+        return pytz.timezone(name)
+    except Exception:
+        return pytz.UTC
+
+
+def get_cache_key(user_id):
+    return f"reminders:timezone:{user_id}"
+
+
+def get_user_timezone(user):
+    """
+    Return the user's timezone without querying on every call.
+
+    The timezone is memoized on the user object itself, which lives for one
+    request (request.user), and in Django's cache for TIMEZONE_CACHE_TTL
+    seconds. The entry is deleted when the user's profile is saved or
+    deleted; processes that don't share the cache see the change once it
+    expires. Users without a profile get UTC.
+    """
+    cached = getattr(user, '_timezone', None)
+    if cached is not None:
+        return cached
+
+    key = get_cache_key(user.pk)
+    name = cache.get(key)
+    if name is None:
+        name = load_timezone_name(user)
+        cache.set(key, name, getattr(settings, 'TIMEZONE_CACHE_TTL', 300))
+
+    user._timezone = get_timezone(name)
+    return user._timezone
+
+
+def load_timezone_name(user):
+    from .models import UserProfile
+
+    # Use the profile if it was already loaded (e.g. with select_related)
+    profile = user._state.fields_cache.get('userprofile')
+    if profile is not None:
+        return profile.timezone
+    return UserProfile.objects.filter(user_id=user.pk).values_list('timezone', flat=True).first() or 'UTC'
+
+
+def invalidate(profile):
+    """Forget the cached timezone of a user whose profile changed"""
+    cache.delete(get_cache_key(profile.user_id))
+    user = profile._state.fields_cache.get('user')
+    if user is not None:
+        user.__dict__.pop('_timezone', None)
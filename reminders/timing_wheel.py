@@ -0,0 +1,106 @@
+import redis
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Notification
+from .redis_client import get_client
+
+# Pops due members and removes them in one atomic step, so two dispatchers
+# never receive the same notification id
+POP_DUE_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #ids > 0 then
+    redis.call('ZREM', KEYS[1], unpack(ids))
+end
+return ids
+"""
+
+
+def is_enabled():
+    return getattr(settings, 'NOTIFICATION_TIMING_WHEEL_ENABLED', False)
+
+
+class TimingWheel:
+    """
+    Redis sorted set of upcoming notification ids scored by epoch seconds.
+
+    Dispatchers pop due ids with second-level precision instead of polling
+    the Notification table. PostgreSQL stays the source of truth: popped ids
+    are still claimed through the database, the periodic database dispatch
+    keeps running as a safety net, and reconcile() repairs any drift.
+    """
+
+    KEY = 'reminders:notification-wheel'
+
+    def __init__(self, client=None):
+        self.client = client or get_client()
+
+    def add(self, notifications):
+        """Add notifications to the wheel, keyed by their next delivery attempt"""
+        members = {
+            str(notification.id): (notification.next_attempt_at or notification.scheduled_time).timestamp()
+            for notification in notifications
+        }
+        if members:
+            self.client.zadd(self.KEY, members)
+
+    def remove(self, notification_ids):
+        if notification_ids:
+            self.client.zrem(self.KEY, *[str(notification_id) for notification_id in notification_ids])
+
+    def pop_due(self, now=None, limit=None):
+        """Atomically remove and return the ids of notifications due at or before now"""
+        now = now or timezone.now()
+        limit = limit or getattr(settings, 'NOTIFICATION_DISPATCH_BATCH_SIZE', 100)
+        ids = self.client.eval(POP_DUE_SCRIPT, 1, self.KEY, now.timestamp(), limit)
+        return [int(notification_id) for notification_id in ids]
+
+    def reconcile(self, horizon=None):
+        """
+        Repair drift between the wheel and the Notification table.
+
+        Pending notifications due within the horizon that are missing from the
+        wheel (or scored with a stale attempt time) are added; members whose
+        notification was sent, dead-lettered or deleted are removed. Returns
+        the number of (added, removed) members.
+        """
+        horizon = horizon or timedelta(seconds=getattr(settings, 'NOTIFICATION_TIMING_WHEEL_HORIZON', 86400))
+        cutoff = timezone.now() + horizon
+
+        expected = {
+            str(notification_id): next_attempt_at.timestamp()
+            for notification_id, next_attempt_at in Notification.objects.filter(
+                status='pending',
+                next_attempt_at__lte=cutoff
+            ).values_list('id', 'next_attempt_at').iterator()
+        }
+        current = {
+            member.decode(): score
+            for member, score in self.client.zrangebyscore(self.KEY, '-inf', cutoff.timestamp(), withscores=True)
+        }
+
+        missing = {member: score for member, score in expected.items() if current.get(member) != score}
+        stale = [member for member in current if member not in expected]
+
+        if missing:
+            self.client.zadd(self.KEY, missing)
+        if stale:
+            self.client.zrem(self.KEY, *stale)
+
+        return len(missing), len(stale)
+
+
+def schedule_on_commit(notifications):
+    """Add freshly created notifications to the timing wheel once their transaction commits"""
+    if not is_enabled() or not notifications:
+        return
+
+    def add():
+        try:
+            TimingWheel().add(notifications)
+        except redis.RedisError as e:
+            # The reconciliation sweep will add them later
+            print(f"Failed to add notifications to timing wheel: {e}")
+
+    transaction.on_commit(add)
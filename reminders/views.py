@@ -119,7 +119,7 @@ class TagViewSet(viewsets.ModelViewSet):
     def reminders(self, request, pk=None):
         """Return all reminders associated with this tag"""
         tag = self.get_object()
-        reminders = tag.reminders.filter(user=request.user)
+        reminders = ReminderSerializer.setup_eager_loading(tag.reminders.filter(user=request.user), request.user)
         
         page = self.paginate_queryset(reminders)
         if page is not None:
@@ -152,6 +152,8 @@ class ReminderViewSet(viewsets.ModelViewSet):
     filterset_fields = ['is_completed', 'is_flagged', 'priority', 'tags']
     search_fields = ['title', 'description']
     ordering_fields = ['date', 'time', 'created_at', 'priority', 'title']
+    # Actions serializing whole pages of reminders, which load them eagerly
+    list_actions = ['list', 'upcoming', 'scheduled', 'flagged']
     
     def get_queryset(self):
         user = self.request.user
@@ -190,6 +192,8 @@ class ReminderViewSet(viewsets.ModelViewSet):
         if not ordering:
             queryset = queryset.order_by('date', 'time')
         
+        if self.action in self.list_actions:
+            return ReminderSerializer.setup_eager_loading(queryset, user)
         return queryset
     
     @action(detail=True, methods=['post'])
@@ -210,7 +214,7 @@ class ReminderViewSet(viewsets.ModelViewSet):
     def toggle_flag(self, request, pk=None):
         reminder = self.get_object()
         reminder.is_flagged = not reminder.is_flagged
-        reminder.save()
+        reminder.save(update_fields=['is_flagged', 'updated_at'])
         return Response({'status': 'flag toggled', 'is_flagged': reminder.is_flagged})
     
     @action(detail=False, methods=['get'])
@@ -346,7 +350,7 @@ class ReminderViewSet(viewsets.ModelViewSet):
         image = request.FILES['image']
         
         reminder.image = image
-        reminder.save()
+        reminder.save(update_fields=['image', 'updated_at'])
         
         serializer = self.get_serializer(reminder)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -362,7 +366,7 @@ class ReminderViewSet(viewsets.ModelViewSet):
                 reminder.image.storage.delete(reminder.image.name)
             
             reminder.image = None
-            reminder.save()
+            reminder.save(update_fields=['image', 'updated_at'])
             
             return Response({"detail": "Image removed successfully"}, status=status.HTTP_204_NO_CONTENT)
         else:
@@ -493,7 +497,7 @@ def reminder_subtask_toggle_flag(request, reminder_id, subtask_id):
         return Response({"detail": "Not found."}, status=404)
         
     subtask.is_flagged = not subtask.is_flagged
-    subtask.save()
+    subtask.save(update_fields=['is_flagged', 'updated_at'])
     return Response({"status": "flag toggled", "is_flagged": subtask.is_flagged})
 
 class SubTaskViewSet(viewsets.ModelViewSet):
@@ -566,7 +570,7 @@ class SubTaskViewSet(viewsets.ModelViewSet):
     def toggle_flag(self, request, pk=None):
         subtask = self.get_object()
         subtask.is_flagged = not subtask.is_flagged
-        subtask.save()
+        subtask.save(update_fields=['is_flagged', 'updated_at'])
         return Response({'status': 'flag toggled', 'is_flagged': subtask.is_flagged})
 
 class DeviceTokenViewSet(viewsets.ModelViewSet):